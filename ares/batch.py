@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+# Master in High-Performance Computing - SISSA
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append("../src")
+sys.path.append("../src/GlobalTracker")
+sys.path.append("../src/LocalTracker")
+sys.path.append("../src/Matcher")
+sys.path.append("../src/Utils")
+
+import GlobalTracker.world as World
+import Matcher.linker as Linker
+import Matcher.matcher as GlobalMatcher
+import Matcher.registry as Registry
+from Matcher.gating import absolute_position
+from LocalTracker.snapshot import DescriptorSnapshot
+import mcherry as Dataset
+import Utils.json_settings as Settings
+
+"""
+Development notes:
+- The sequence is split into segments. Each segment owns the frames
+  [own_start, stop) and starts tracking overlap frames earlier, so its
+  trackers are already labelled when its own frames begin
+- The segments are tracked in parallel by independent worlds (one per
+  process). The labels are local to each segment
+- At each boundary, both segments track the overlap frames. The labels of
+  the previous segment (tail) and of the next one (head) are joined with
+  a Hungarian assignment. A pair is admissible if both tracks stay close
+  during the overlap and the global matcher scores their descriptors
+  (taken at the last overlap frame) over its threshold
+- The unmatched labels of a segment start new global labels
+- The dataset is inherited by the workers (fork), so the memory-mapped
+  stacks are not copied
+"""
+
+# Dataset shared with the workers
+_dataset = None
+_order = None
+
+
+def segments(n_frames, length, overlap):
+    """
+    Splits the sequence into segments
+    Returns: list((start, own_start, stop))
+    """
+    result = []
+    for own_start in range(0, n_frames, length):
+        start = max(own_start - overlap, 0)
+        stop = min(own_start + length, n_frames)
+        result.append((start, own_start, stop))
+    return result
+
+
+def _summaries(trackers):
+    """
+    Returns {label: tracker} of the labelled trackers
+    """
+    labelled = {}
+    for tracker in trackers:
+        if tracker.label is None or tracker.position is None:
+            continue
+        labelled[tracker.label["id"]] = tracker
+    return labelled
+
+
+def track_segment(job):
+    """
+    Tracks a segment in a new world
+
+    Params:
+    * job: (settings path, (start, own_start, stop), overlapping, sampling)
+
+    Returns: dict with
+    * tracks: {label: {frame: (x, y)}} of the current trackers
+    * head: {label: snapshot} at the frame before own_start (if any)
+    * tail: {label: snapshot} at the last frame
+    """
+    path, segment, overlapping, sampling = job
+    start, own_start, stop = segment
+
+    settings = Settings.Settings(path)
+    world_size = settings.set_if_defined("world_size", Dataset.WORLD_SIZE)
+    scene_size = settings.set_if_defined("scene_size", Dataset.SCENE_SIZE)
+    tiling = Dataset.get_tiling(settings, scene_size, overlapping, world_size)
+
+    tracking_world = World.World(settings)
+    tracking_world.spawn_scenes(tiling, overlapping, sampling)
+
+    tracks = {}
+    head = {}
+    tail = {}
+    for frame_idx in range(start, stop):
+        scenes = [_dataset[_order[i]][frame_idx] for i in range(len(_order))]
+        tracking_world.update_trackers(scenes)
+
+        current = _summaries(tracking_world.trackers(Registry.CURRENT))
+        for label, tracker in current.items():
+            tracks.setdefault(label, {})[frame_idx] = absolute_position(tracker)
+
+        if frame_idx == own_start - 1:
+            head = {l: DescriptorSnapshot(t) for l, t in current.items()}
+        if frame_idx == stop - 1:
+            tail = {l: DescriptorSnapshot(t) for l, t in current.items()}
+
+    return {"segment": segment, "tracks": tracks, "head": head, "tail": tail}
+
+
+def _overlap_distance(lhs, rhs, frames):
+    """
+    Mean distance between two tracks over the common frames. None if they
+    never coexist
+    """
+    common = [f for f in frames if f in lhs and f in rhs]
+    if len(common) == 0:
+        return None
+    lhs = np.array([lhs[f] for f in common], dtype=np.float32)
+    rhs = np.array([rhs[f] for f in common], dtype=np.float32)
+    return float(np.linalg.norm(lhs - rhs, axis=1).mean())
+
+
+def join(previous, following, matcher, radius=20):
+    """
+    Joins the labels of two consecutive segments
+
+    Params:
+    * previous, following: results of track_segment
+    * matcher: global matcher used to score the descriptors
+    * radius: maximum mean distance in pixels during the overlap
+
+    Returns: {following label: previous label}
+    """
+    start, own_start, _ = following["segment"]
+    frames = range(start, own_start)
+    tail = list(previous["tail"].items())
+    head = list(following["head"].items())
+    if len(tail) == 0 or len(head) == 0:
+        return {}
+
+    # Cost matrix: negative score, the inadmissible pairs are never taken
+    invalid = 1e6
+    costs = np.full((len(head), len(tail)), invalid, dtype=np.float64)
+    for i, (h_label, h_snapshot) in enumerate(head):
+        h_track = following["tracks"].get(h_label, {})
+        for j, (t_label, t_snapshot) in enumerate(tail):
+            distance = _overlap_distance(
+                h_track, previous["tracks"].get(t_label, {}), frames
+            )
+            if distance is None or distance > radius:
+                continue
+            score = matcher.score(h_snapshot, [t_snapshot])[0]
+            if score >= matcher.threshold:
+                costs[i, j] = -score
+
+    rows, cols = linear_sum_assignment(costs)
+    links = {}
+    for i, j in zip(rows, cols):
+        if costs[i, j] < invalid:
+            links[head[i][0]] = tail[j][0]
+    return links
+
+
+def stitch(results, matcher, radius=20):
+    """
+    Builds the global trace of the segments
+
+    Returns:
+    * trace: list of frames, each a list of {"label", "abs_position",
+      "status", "spawn_time"} (see Utils/json_tracer)
+    * stats: {"segments", "labels", "joined"}
+    """
+    trace = []
+    last_id = 0
+    joined = 0
+    spawn = {}
+    previous_labels = {}
+
+    for k, result in enumerate(results):
+        links = {}
+        if k > 0:
+            links = join(results[k - 1], result, matcher, radius)
+            joined += len(links)
+
+        # Map the local labels to global ones
+        labels = {}
+        for label in sorted(result["tracks"].keys()):
+            if label in links and links[label] in previous_labels:
+                labels[label] = previous_labels[links[label]]
+                continue
+            last_id += 1
+            labels[label] = last_id
+
+        _, own_start, stop = result["segment"]
+        for frame_idx in range(own_start, stop):
+            frame = []
+            for label, track in result["tracks"].items():
+                if not frame_idx in track:
+                    continue
+                glabel = labels[label]
+                spawn.setdefault(glabel, frame_idx)
+                x, y = track[frame_idx]
+                frame.append(
+                    {
+                        "label": glabel,
+                        "abs_position": [float(x), float(y)],
+                        "status": Registry.CURRENT,
+                        "spawn_time": spawn[glabel],
+                    }
+                )
+            trace.append(frame)
+        previous_labels = labels
+
+    stats = {"segments": len(results), "labels": last_id, "joined": joined}
+    return trace, stats
+
+
+def create_matcher(settings):
+    """
+    Global matcher used to join the segments
+    """
+    return GlobalMatcher.Matcher(
+        settings.set_if_defined("global_matcher_weights", None),
+        settings.set_if_defined("global_matcher_threshold", None),
+        world_size=settings.set_if_defined("world_size", None),
+    )
+
+
+def run(path, dataset, order, length, overlap, overlapping, sampling, workers):
+    """
+    Tracks the dataset in parallel segments and stitches them
+    Returns: (trace, stats)
+    """
+    global _dataset, _order
+    _dataset, _order = dataset, order
+
+    settings = Settings.Settings(path)
+    n_frames = dataset.shape[1]
+    jobs = [
+        (path, segment, overlapping, sampling)
+        for segment in segments(n_frames, length, overlap)
+    ]
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(processes=workers) as pool:
+        results = pool.map(track_segment, jobs, chunksize=1)
+
+    radius = settings.set_if_defined("batch_join_radius", 20)
+    return stitch(results, create_matcher(settings), radius)
+
+
+def main(args):
+    # Retrieve settings
+    settings = Settings.Settings(args.dataset)
+    if not settings.is_valid():
+        print("Error: Settings not valid")
+        return
+
+    scene_size = settings.set_if_defined("scene_size", Dataset.SCENE_SIZE)
+    overlapping = settings.set_if_defined("overlapping", args.overlapping)
+
+    # Retrieve the dataset
+    h, w = scene_size
+    print("Loading data...")
+    dataset, order = Dataset.load(settings, resizeTo=(w, h))
+    print("Loaded: ", dataset.shape)
+
+    start = time.time()
+    trace, stats = run(
+        args.dataset,
+        dataset,
+        order,
+        args.segment_length,
+        args.segment_overlap,
+        overlapping,
+        args.sampling_rate_detection,
+        args.workers,
+    )
+    stats["time"] = round(time.time() - start, 2)
+    print("Batch:", stats)
+
+    # Offline gap closing over the stitched trace
+    linking = settings.set_if_defined("offline_linker", None)
+    if not linking is None:
+        linker = Linker.Linker(**linking)
+        Linker.relabel(trace, linker.link(Linker.Tracklets(trace)))
+        print("Linker:", linker.stats)
+
+    file_name = settings.set_if_defined("file_prefix", "results") + "_batch.json"
+    with open(file_name, "w") as outfile:
+        json.dump(trace, outfile)
+
+
+if __name__ == "__main__":
+    # Handle the arguments
+    parser = argparse.ArgumentParser(
+        description="Performs the tracking in parallel time segments"
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        help="Choose the dataset",
+        default="../data/mcherry/mcherry_single.json",
+    )
+    parser.add_argument(
+        "--overlapping", type=int, help="Overlapping of the scene in pixels", default=10
+    )
+    parser.add_argument(
+        "--sampling_rate_detection",
+        type=float,
+        help="Decimation of the detection",
+        default=3,
+    )
+    parser.add_argument(
+        "--segment_length", type=int, help="Frames owned by a segment", default=300
+    )
+    parser.add_argument(
+        "--segment_overlap",
+        type=int,
+        help="Frames tracked by two consecutive segments",
+        default=30,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes (default: CPU count)",
+        default=None,
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -20,61 +20,70 @@
 #
 # This project was sponsored by CNR-IOM
 
-import cv2 as cv
-import glob
 import numpy as np
 import sys
 
 sys.path.append("../src/")
 
+import Utils.frame_cache as FrameCache
 import Utils.tiff as TiffUtils
+import manifest as Manifest
 
 
-def sortKey(name):
-    file = name.split("/")[-1]
-    splitted = file.split(".")
-    splitted = splitted[0].split("_")
-    X = int(splitted[1])
-    return X
-
-
-def load(path="../data/ctrl6_72h", n=4, resizeTo=(640, 480)):
+def load(
+    path="../data/ctrl6_72h",
+    n=4,
+    resizeTo=(640, 480),
+    scenes=None,
+    times=None,
+    cache=FrameCache.DEFAULT_ROOT,
+):
     """
     Get a numpy array with the shape (n, m, h, w), where n is the number of scenes,
     m is the number of frames, h is the image height and w is the image width
+
+    The files are indexed by a manifest cached next to the data. The scenes
+    (list) and the times (start, stop) restrict the loaded range. The
+    stack is memory-mapped from the frame cache (None disables it)
     """
     normalisation = 2048
     black_offset = 64
 
-    files = glob.glob(path + "/*.tif")
-    files.sort(key=sortKey)
+    # Format : image3_X_Y.tiff -> scene X % n, time X // n, plane Y
+    index = Manifest.Manifest(path, ".tif")
+    selected = index.select(n, scenes, times, skip_planes=(1,))
+    files = [file for _, _, file in selected]
 
-    # Prepare array:
-    data = []
-    for i in range(n):
-        data.append(list([]))
+    def build():
+        # Prepare array:
+        data = []
+        for i in range(n):
+            data.append(list([]))
 
-    for i in files:
-        file = i.split("/")[-1]
-        splitted = file.split(".")
-        splitted = splitted[0].split("_")
-        # Format : image3_X_Y.tiff -> ['image3', X, Y]
+        # Open images - Normalised to 2048 with the black offset
+        images = TiffUtils.tiff12_load(files, normalisation, black_offset, resizeTo)
 
-        Y = int(splitted[2])
-        if Y == 1:
-            continue
-        X = int(splitted[1])
-        mod = X % n
-
-        # Open image - Normalised to 2048
-        tiff = TiffUtils.tiff12_open(i, normalisation)
-        tiff = cv.resize(tiff, resizeTo)
+        # Append data
+        for (mod, _, _), tiff in zip(selected, images):
+            data[mod].append(tiff)
 
-        # Black normalisation
-        tiff += black_offset
+        if not scenes is None:
+            data = [data[i] for i in scenes]
+        return np.array(data)
 
-        # Append data
-        data[mod].append(tiff)
+    frames = FrameCache.create(cache)
+    params = {
+        "loader": "tiff12",
+        "n": n,
+        "size": list(resizeTo),
+        "scenes": scenes,
+        "times": times,
+        "normalisation": normalisation,
+        "black_offset": black_offset,
+    }
+    # Keyed on the images themselves: overwriting one in place does not
+    # change the directory
+    data = frames.load(files, params, build)
 
-    # Convert into numpy array
-    return np.array(data), [i for i in range(n)]
+    # Scenes in the order of the data
+    return data, [i for i in range(data.shape[0])]
@@ -23,7 +23,6 @@
 # Master in High-Performance Computing - SISSA
 
 import argparse
-import cv2 as cv
 import sys
 import time
 
@@ -35,11 +34,22 @@ sys.path.append("../src/Utils")
 
 import GlobalTracker.world as World
 import GlobalTracker.utils as Utils
+import GlobalTracker.tiling as Tiling
+import Matcher.linker as Linker
+import Matcher.registry as Registry
 import mcherry as Dataset
+import replay as Replay
 import Utils.json_settings as Settings
 from Utils.json_tracer import Tracer
+from Utils.recorder import Recorder
+import Utils.viewer as Viewer
 
 def main(args):
+    # Headless: no drawing at all
+    if args.headless:
+        args.display = False
+        args.record = False
+
     # Retrieve settings
     settings = Settings.Settings(args.dataset)
     if not settings.is_valid():
@@ -66,43 +76,87 @@ def main(args):
     tracking_world.attach_tracer(tracer)
 
     # Generate scenes
-    rois = Dataset.get_rois(settings, scene_size, overlapping)
-    tracking_world.spawn_scenes(rois, overlapping, args.sampling_rate_detection)
+    tiling = Dataset.get_tiling(settings, scene_size, overlapping, world_size)
+    rois = tiling.rois
+    tracking_world.spawn_scenes(tiling, overlapping, args.sampling_rate_detection)
+    stitcher = Tiling.Stitcher(tiling)
+
+    # Scene outputs for replaying the matchers (see replay.py)
+    trackers_record = None
+    if not args.record_trackers is None:
+        trackers_record = Replay.TrackerRecorder(args.record_trackers, rois)
+        tracking_world.attach_recorder(trackers_record)
 
     if args.record:
-        fourcc = cv.VideoWriter_fourcc(*"MP4V")
-        record = cv.VideoWriter("./video.mp4", fourcc, 25, (W, H), True)
+        record = Recorder(
+            "./video.mp4",
+            (W, H),
+            args.framerate / args.record_decimation,
+            policy=args.record_policy,
+            decimation=args.record_decimation,
+            scale=args.record_scale,
+        )
+
+    # The display runs in another process fed through shared memory
+    viewer = Viewer.create(args.display, (H, W, 3), "World")
 
     # Run the simulation
+    render = args.display or args.record
     for frame_idx in range(n_frames):
-        frames = []
-        for i in range(len(order)):
-            # Refresh scene
-            frames.append(cv.cvtColor(dataset[order[i]][frame_idx], cv.COLOR_GRAY2BGR))
+        # Refresh scenes: the frames stay single-channel
+        scenes = [dataset[order[i]][frame_idx] for i in range(len(order))]
 
         # Update scenes
-        tracking_world.update_trackers(frames)
+        tracking_world.update_trackers(scenes)
+        print(".", end="")
+        sys.stdout.flush()
 
-        # Draw rectange overlay to determine where are the ROIS
-        drawing = Utils.naive_stitch(frames, world_size, scene_size, order)
-        Utils.draw_roi(drawing, rois)
+        # Nothing to show: skip the drawing and the player delay
+        if not render:
+            continue
+
+        # The grayscale scenes are broadcast into the persistent canvas
+        drawing = stitcher.stitch(scenes)
 
-        # Label the world objects
+        # Label the world objects. The overlays go on the copy, so the
+        # canvas keeps only the scenes
         world_labeled = tracking_world.draw_trackers(drawing)
-        print(".", end="")
-        sys.stdout.flush()
+
+        # Draw rectange overlay to determine where are the ROIS
+        Utils.draw_roi(world_labeled, rois)
 
         if args.display:
-            cv.imshow("World", world_labeled)
-            cv.waitKey(1)
+            stats = tracking_world.tracker_counts()
+            stats["frame"] = frame_idx
+            viewer.publish(world_labeled, stats)
 
         if args.record:
             record.write(world_labeled)
 
         time.sleep(args.delay_player)
 
+    viewer.close()
+    tracking_world.save_detections()
+    if not tracking_world.detection_stats() is None:
+        print("Detection cache:", tracking_world.detection_stats())
+    if not trackers_record is None:
+        trackers_record.close()
+
+    # Offline gap closing: the trace is relabelled before being dumped
+    linking = settings.set_if_defined("offline_linker", None)
+    if not linking is None:
+        # Only the current trackers: the pool entries are frozen and would
+        # extend the tracklets until they expire
+        linking = dict(linking)
+        status = linking.pop("status", [Registry.CURRENT])
+        linker = Linker.Linker(**linking)
+        labels = linker.link(Linker.Tracklets(tracer.data(), status=status))
+        Linker.relabel(tracer.data(), labels)
+        print("Linker:", linker.stats)
+
     if args.record:
         record.release()
+        print("Recording:", record.stats)
 
 
 if __name__ == "__main__":
@@ -136,11 +190,42 @@ if __name__ == "__main__":
         help="In case of recording, the framerate",
         default=25,
     )
+    parser.add_argument(
+        "--record_decimation",
+        type=int,
+        help="In case of recording, record one of each n frames",
+        default=1,
+    )
+    parser.add_argument(
+        "--record_scale",
+        type=float,
+        help="In case of recording, downscaling of the video",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--record_policy",
+        type=str,
+        help="In case of recording, drop or block if the encoder is behind",
+        default="drop",
+    )
+    parser.add_argument(
+        "--record_trackers",
+        type=str,
+        help="Record the scene outputs into a file for replaying",
+        default=None,
+    )
     parser.add_argument(
         "--no-display", help="Display analysis", dest="display", action="store_false"
     )
+    parser.add_argument(
+        "--headless",
+        help="Skip all the drawing, display, recording and delays",
+        dest="headless",
+        action="store_true",
+    )
     parser.set_defaults(display=True)
     parser.set_defaults(record=False)
+    parser.set_defaults(headless=False)
 
     args = parser.parse_args()
     main(args)
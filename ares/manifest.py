@@ -0,0 +1,149 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import json
+import os
+
+"""
+Development notes:
+- The acquisitions are named prefix_X_Y.tif, where X is the acquisition
+  index and Y the plane. With n scenes, the scene is X % n and the time
+  is X // n
+- The directory is scanned once and the entries (name, X, Y) are sorted
+  by X and kept in a manifest next to the data
+- The manifest is valid while it is newer than the directory: adding,
+  removing or renaming files updates the mtime of the directory. It is
+  rewritten in place (not renamed), so its own creation does not
+  invalidate it
+- If the directory is read-only, the manifest is just not cached
+"""
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def parse(name, suffix=".tif"):
+    """
+    Parses prefix_X_Y.tif
+    Returns: (X, Y) or None if the name does not follow the format
+    """
+    if not name.endswith(suffix):
+        return None
+    tokens = name[0 : -len(suffix)].split("_")
+    if len(tokens) < 3:
+        return None
+    try:
+        return (int(tokens[-2]), int(tokens[-1]))
+    except ValueError:
+        return None
+
+
+def scan(path, suffix=".tif"):
+    """
+    Scans the directory
+    Returns: list([name, X, Y]) sorted by X
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            tokens = parse(entry.name, suffix)
+            if tokens is None:
+                continue
+            entries.append([entry.name, tokens[0], tokens[1]])
+    entries.sort(key=lambda e: (e[1], e[2], e[0]))
+    return entries
+
+
+class Manifest:
+    def __init__(self, path, suffix=".tif", cache=True):
+        """
+        Params:
+        * path: directory of the acquisition
+        * suffix: extension of the images
+        * cache: reads and writes the manifest next to the data
+        """
+        self.path = path
+        self.suffix = suffix
+        self.cached = False
+        self.entries = None
+
+        if cache:
+            self.entries = self._read()
+        if self.entries is None:
+            self.entries = scan(path, suffix)
+            if cache:
+                self._write()
+        else:
+            self.cached = True
+
+    def _file(self):
+        return os.path.join(self.path, MANIFEST_NAME)
+
+    def _read(self):
+        file = self._file()
+        try:
+            if os.stat(file).st_mtime_ns <= os.stat(self.path).st_mtime_ns:
+                return None
+            with open(file, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("suffix") != self.suffix:
+            return None
+        return manifest.get("entries")
+
+    def _write(self):
+        manifest = {"suffix": self.suffix, "entries": self.entries}
+        try:
+            with open(self._file(), "w") as f:
+                json.dump(manifest, f, separators=(",", ":"))
+        except OSError:
+            pass
+
+    def select(self, n=1, scenes=None, times=None, skip_planes=()):
+        """
+        Selects the images of a range of scenes and times
+
+        Params:
+        * n: number of scenes of the acquisition
+        * scenes: list of scenes (default: all)
+        * times: (start, stop) of the time range (default: all)
+        * skip_planes: planes to discard
+
+        Returns: list((scene, time, file)) sorted by acquisition
+        """
+        start, stop = (0, None) if times is None else times
+        selected = []
+        for name, X, Y in self.entries:
+            if Y in skip_planes:
+                continue
+            scene, time = X % n, X // n
+            if time < start or (not stop is None and time >= stop):
+                continue
+            if not scenes is None and not scene in scenes:
+                continue
+            selected.append((scene, time, os.path.join(self.path, name)))
+        return selected
+
+    def __len__(self):
+        return len(self.entries)
@@ -27,26 +27,26 @@ import sys
 
 sys.path.append("../src/")
 
+import GlobalTracker.tiling as Tiling
+import Utils.frame_cache as FrameCache
+
 SCENE_SIZE = (960, 1280)
 SCENE_SIZE_SW = (1280, 960)
 WORLD_SIZE = (960, 1280)
 
 
-def get_rois(settings, roi_size, overlapping):
-    h, w = roi_size
-    h_p = h - (overlapping)
-    w_p = w - (overlapping)
-    rois = list([])
+def get_tiling(settings, roi_size, overlapping, world_size=None):
+    """
+    Builds the tiling of the scenes given by the stitching setting [fx, fy].
+    The grid is shifted by half of the overlapping
+    """
     fx, fy = settings.set_if_defined("stitching", [1,1])
+    origin = (int(overlapping * 0.5), int(overlapping * 0.5))
+    return Tiling.grid(roi_size, overlapping, (fy, fx), origin, world_size)
+
 
-    for j in range(fy):
-        for i in range(fx):
-            x1 = i * w_p + int((overlapping * 0.5))
-            x2 = x1 + w
-            y1 = j * h_p + int((overlapping * 0.5))
-            y2 = y1 + h
-            rois.append(((x1, x2), (y1, y2)))
-    return rois
+def get_rois(settings, roi_size, overlapping):
+    return get_tiling(settings, roi_size, overlapping).rois
 
 
 def load(settings=None, n=1, resizeTo=SCENE_SIZE_SW, k=7):
@@ -61,8 +61,8 @@ def load(settings=None, n=1, resizeTo=SCENE_SIZE_SW, k=7):
     H, W = settings.set_if_defined("original_size", [1920, 2560])
     size = (W, H)
 
-    # Open video
-    caps = []
+    # Video files
+    files = []
     n = settings.set_if_defined("scenes", n)
     path = "../"
     path += settings.set_if_defined("file_path", "data/mcherry")
@@ -76,10 +76,26 @@ def load(settings=None, n=1, resizeTo=SCENE_SIZE_SW, k=7):
         else:
             file = path + "/" + prefix + suffix
         print(file)
-        caps.append(cv.VideoCapture(file))
+        files.append(file)
 
-    # Number of images within the stitching
-    frames_stitching = settings.set_if_defined("stitching", [1,1])
+    # Decoded videos are cached (memory-mapped) for the next runs
+    cache = FrameCache.create(
+        settings.set_if_defined("frame_cache", FrameCache.DEFAULT_ROOT)
+    )
+    params = {"loader": "mcherry", "size": list(resizeTo), "gray": True}
+    data = cache.load(files, params, lambda: decode(files, resizeTo))
+    print("Frame cache: ", cache.stats)
+
+    return data, settings.set_if_defined("stitching_order", [0])
+
+
+def decode(files, resizeTo=SCENE_SIZE_SW):
+    """
+    Decodes the videos, converting into grayscale and resizing
+    Returns: numpy array with the shape (n, m, h, w)
+    """
+    n = len(files)
+    caps = [cv.VideoCapture(file) for file in files]
 
     # Prepare array:
     data = []
@@ -108,5 +124,4 @@ def load(settings=None, n=1, resizeTo=SCENE_SIZE_SW, k=7):
     for i in range(n):
         caps[i].release()
 
-    # Convert into numpy array
-    return np.array(data), settings.set_if_defined("stitching_order", [0])
+    return np.array(data)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+# Master in High-Performance Computing - SISSA
+
+import argparse
+import copy
+import gzip
+import itertools
+import json
+import multiprocessing
+import pickle
+import sys
+
+sys.path.append("../src")
+sys.path.append("../src/GlobalTracker")
+sys.path.append("../src/LocalTracker")
+sys.path.append("../src/Matcher")
+sys.path.append("../src/Utils")
+
+import GlobalTracker.world as World
+from LocalTracker.snapshot import DescriptorSnapshot
+import Utils.json_settings as Settings
+
+'''
+A recording is a gzip stream of pickles:
+
+header: {"rois": [[[x0, x1], [y0, y1]], ...]}
+frame: [ <- one entry per scene (pickled on its own)
+  [ <- trackers of the scene after its update
+    {
+      "uid": Number,
+      "flags": NEW | OUT | DEAD,
+      "roi", "position", "samples", "timeout", "version", "velocity",
+      "static": (roi_offset, sample_bins)  <- first time the uid appears
+      "descriptors": (histogram, hog, mosse)  <- when the version changes
+    }
+  ]
+]
+
+The replay feeds the recorded scene outputs to a world, so the matchers
+run without detection, KCF or feature extraction. The decisions of the
+world only reach the scenes through the timeout of the matched trackers,
+which the replayed scenes honour (a zeroed tracker is no longer reported).
+The handoff is not replayed, since it deploys trackers on the frames.
+'''
+
+NEW = 1
+OUT = 2
+DEAD = 4
+
+
+class TrackerRecorder:
+    def __init__(self, path, rois):
+        """
+        Params:
+        * path: output file
+        * rois: ROIs of the scenes
+        """
+        self._file = gzip.open(path, "wb")
+        self._versions = {}
+        self._frame = [b""] * len(rois)
+        pickle.dump({"rois": [list(roi) for roi in rois]}, self._file)
+
+    def push(self, idx, trackers, out, new, dead):
+        """
+        Records the outputs of the scene idx. The records are pickled at
+        once, since the world modifies the trackers afterwards
+        """
+        flagged = {}
+        for flag, reported in ((NEW, new), (OUT, out), (DEAD, dead)):
+            for tracker in reported:
+                flagged[tracker.uid] = flagged.get(tracker.uid, 0) | flag
+
+        records = []
+        for tracker in trackers:
+            record = {
+                "uid": tracker.uid,
+                "flags": flagged.get(tracker.uid, 0),
+                "roi": tracker.roi,
+                "position": tracker.position,
+                "samples": tracker.samples,
+                "timeout": tracker.timeout,
+                "version": tracker.version,
+                "velocity": tracker.velocity,
+            }
+            version = self._versions.get(tracker.uid, None)
+            if version is None:
+                record["static"] = (tracker.roi_offset, tracker.sample_bins)
+            if version != tracker.version:
+                self._versions[tracker.uid] = tracker.version
+                record["descriptors"] = (
+                    tracker.histogram,
+                    tracker.hog,
+                    tracker.mosse.snapshot(),
+                )
+            records.append(record)
+        self._frame[idx] = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def commit(self):
+        """
+        Writes the frame
+        """
+        pickle.dump(self._frame, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._frame = [b""] * len(self._frame)
+
+    def close(self):
+        if not self._file is None:
+            self._file.close()
+            self._file = None
+
+
+class Recording:
+    def __init__(self, path):
+        """
+        Reader of a recording. The frames are iterated as lists of records
+        per scene
+        """
+        self.path = path
+        with gzip.open(path, "rb") as f:
+            self.rois = pickle.load(f)["rois"]
+
+    def __iter__(self):
+        with gzip.open(self.path, "rb") as f:
+            pickle.load(f)
+            while True:
+                try:
+                    frame = pickle.load(f)
+                except EOFError:
+                    return
+                yield [pickle.loads(records) if records else [] for records in frame]
+
+
+class ReplayTracker:
+    """
+    Tracker rebuilt from the records. It exposes what the world, the
+    matchers and the tracer use
+    """
+
+    def __init__(self, uid, scene, record):
+        self.uid = uid
+        self.scene = scene
+        self.roi_offset, self.sample_bins = record["static"]
+        self.colour = (0, 255, 0)
+        self.label = None
+        self.snapshot = None
+        self.pool_time = None
+        self.timeout = record["timeout"]
+
+    def apply(self, record):
+        self.roi = record["roi"]
+        self.position = record["position"]
+        self.samples = record["samples"]
+        self.timeout = record["timeout"]
+        self.version = record["version"]
+        self.velocity = record["velocity"]
+        if "descriptors" in record:
+            self.histogram, self.hog, self.mosse = record["descriptors"]
+            self.snapshot = None
+
+    def freeze(self):
+        self.snapshot = DescriptorSnapshot(self)
+        return self.snapshot
+
+    def hibernate(self):
+        pass
+
+    def descriptors(self):
+        if self.snapshot is None:
+            return self
+        return self.snapshot
+
+
+class ReplayScene:
+    def __init__(self, roi, index):
+        """
+        Scene which reports the recorded trackers instead of tracking
+        """
+        self.roi = roi
+        self.index = index
+        self.trackers = []
+        self._trackers = {}
+        self._records = []
+
+    def load_records(self, records):
+        self._records = records
+
+    def update(self, colour_frame=None):
+        trackers, out, new, dead = [], [], [], []
+        known = {}
+        for record in self._records:
+            uid = record["uid"]
+            tracker = self._trackers.get(uid, None)
+            if tracker is None:
+                tracker = ReplayTracker(uid, self.index, record)
+            known[uid] = tracker
+            # Matched by the world: the scene dropped it
+            if tracker.timeout == 0:
+                continue
+            tracker.apply(record)
+            trackers.append(tracker)
+            if record["flags"] & NEW:
+                new.append(tracker)
+            if record["flags"] & OUT:
+                out.append(tracker)
+            if record["flags"] & DEAD:
+                dead.append(tracker)
+
+        self._trackers = known
+        self.trackers = trackers
+        return trackers, out, new, dead
+
+
+def replay(path, settings, tracer=None):
+    """
+    Drives a world with a recording
+
+    Params:
+    * path: recording
+    * settings: world settings (the handoff is disabled)
+    * tracer: tracer to attach (optional)
+
+    Returns: metrics {"frames", "labels", "relinked", "mean_track_length"}
+    and the matcher statistics
+    """
+    settings = copy.copy(settings)
+    settings.data = dict(settings.data, handoff=False)
+
+    recording = Recording(path)
+    scenes = []
+
+    def factory(roi, index):
+        scenes.append(ReplayScene(roi, index))
+        return scenes[-1]
+
+    tracking_world = World.World(settings)
+    if not tracer is None:
+        tracking_world.attach_tracer(tracer)
+    tracking_world.spawn_scenes(recording.rois, scene_factory=factory)
+
+    frames = 0
+    lengths = {}
+    owners = {}
+    for records in recording:
+        for scene, scene_records in zip(scenes, records):
+            scene.load_records(scene_records)
+        tracking_world.update_trackers()
+        frames += 1
+        for tracker in tracking_world.trackers():
+            label = tracker.label["id"]
+            lengths[label] = lengths.get(label, 0) + 1
+            owners.setdefault(label, set()).add(tracker.uid)
+
+    metrics = {
+        "frames": frames,
+        "labels": len(lengths),
+        "relinked": sum([len(uids) - 1 for uids in owners.values()]),
+        "mean_track_length": sum(lengths.values()) / max(len(lengths), 1),
+    }
+    metrics.update(tracking_world.matcher_stats())
+    return metrics
+
+
+def expand(grid):
+    """
+    Expands a sweep: a dict {setting: [values]} becomes the cartesian
+    product. A list of dicts is taken as it is
+    """
+    if isinstance(grid, list):
+        return grid
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def _evaluate(job):
+    path, settings_path, overrides = job
+    settings = Settings.Settings(settings_path)
+    settings.data.update(overrides)
+    return {"settings": overrides, "metrics": replay(path, settings)}
+
+
+def sweep(path, settings_path, grid, workers=None):
+    """
+    Replays the recording with each set of settings in a process pool
+    Returns: list({"settings", "metrics"}) in the order of the sweep
+    """
+    jobs = [(path, settings_path, overrides) for overrides in expand(grid)]
+    with multiprocessing.Pool(processes=workers) as pool:
+        return pool.map(_evaluate, jobs, chunksize=1)
+
+
+def main(args):
+    settings = Settings.Settings(args.dataset)
+    if not settings.is_valid():
+        print("Error: Settings not valid")
+        return
+
+    if args.sweep is None:
+        print(json.dumps(replay(args.recording, settings)))
+        return
+
+    with open(args.sweep) as f:
+        grid = json.load(f)
+    results = sweep(args.recording, args.dataset, grid, args.workers)
+    for result in results:
+        print(json.dumps(result))
+    if not args.output is None:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile)
+
+
+if __name__ == "__main__":
+    # Handle the arguments
+    parser = argparse.ArgumentParser(
+        description="Replays recorded scene outputs through the matchers"
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        help="Choose the dataset",
+        default="../data/mcherry/mcherry_single.json",
+    )
+    parser.add_argument(
+        "--recording", type=str, help="Recording file", default="./trackers.rec"
+    )
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        help="JSON with the settings to sweep ({key: [values]} or [{...}])",
+        default=None,
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Processes (default: CPU count)", default=None
+    )
+    parser.add_argument(
+        "--output", type=str, help="File to write the sweep results", default=None
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,91 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- Two scenes are adjacent if their ROIs overlap or touch each other
+- The neighbourhood of a scene includes the scenes reachable within a given
+  number of hops (and the scene itself). A tracker can only be matched
+  against the trackers that left a scene in its neighbourhood
+- The trackers without a scene (i.e. not deployed by a scene) are
+  reachable from everywhere
+"""
+
+
+def _touches(lhs, rhs):
+    (lx0, lx1), (ly0, ly1) = lhs
+    (rx0, rx1), (ry0, ry1) = rhs
+    return lx0 <= rx1 and rx0 <= lx1 and ly0 <= ry1 and ry0 <= ly1
+
+
+class SceneGraph:
+    def __init__(self, rois, hops=1):
+        """
+        Params:
+        * rois: list([[x0, x1],[y0, y1]]) in the order of the scenes
+        * hops: how far the neighbourhood of a scene goes
+        """
+        self.hops = hops
+        self._neighbours = []
+        for i, roi in enumerate(rois):
+            self._neighbours.append(
+                [j for j, other in enumerate(rois) if i != j and _touches(roi, other)]
+            )
+
+        # Breadth-first search up to the number of hops
+        self._reach = []
+        for i in range(len(rois)):
+            reached = {i}
+            frontier = [i]
+            for hop in range(hops):
+                following = []
+                for j in frontier:
+                    for k in self._neighbours[j]:
+                        if not k in reached:
+                            reached.add(k)
+                            following.append(k)
+                frontier = following
+            self._reach.append(frozenset(reached))
+
+    def neighbours(self, idx):
+        """
+        Returns the indices of the scenes adjacent to the scene idx
+        """
+        return self._neighbours[idx]
+
+    def neighbourhood(self, idx):
+        """
+        Returns the indices of the scenes reachable from the scene idx
+        (including itself)
+        """
+        return self._reach[idx]
+
+    def adjacent(self, lhs, rhs):
+        """
+        Checks if the scene rhs is in the neighbourhood of the scene lhs
+        """
+        if lhs is None or rhs is None:
+            return True
+        return rhs in self._reach[lhs]
+
+    def __len__(self):
+        return len(self._neighbours)
@@ -0,0 +1,149 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- When a tracker goes out of its scene, it is offered to the adjacent
+  scenes. If one of them already tracks the cell (its tracker overlaps the
+  ROI), that tracker takes the state of the old one. No tracker is
+  deployed, so the cell never gets two identities
+- Otherwise, the handoff is left pending for some frames. The first
+  tracker deployed by the neighbour close to the predicted position takes
+  the state without waiting for the warm-up and the matcher
+- The pending handoffs are dropped when they expire or when the tracker
+  leaves the out-of-scene pool (i.e. relinked by the matcher)
+"""
+
+import Matcher.registry as Registry
+from Matcher.gating import absolute_position
+from Matcher.gating import estimated_speed
+
+
+def world_roi(tracker):
+    """
+    Translates the ROI of the tracker to the world reference system
+    """
+    (x1, y1), (x2, y2) = tracker.roi
+    x0, y0 = (0, 0) if tracker.roi_offset is None else tracker.roi_offset
+    return ((x1 + x0, y1 + y0), (x2 + x0, y2 + y0))
+
+
+class Handoff:
+    def __init__(self, scenes, graph, radius=96, window=30):
+        self._scenes = scenes
+        self._graph = graph
+        self._pending = [{} for scene in scenes]
+
+        # Hyper-parameters
+        self.radius = radius
+        self.window = window
+
+        self.stats = {"direct": 0, "relinked": 0, "dropped": 0}
+
+    def _predict(self, tracker, frame_cnt):
+        elapsed = 0
+        if not tracker.pool_time is None:
+            elapsed = max(frame_cnt - tracker.pool_time, 0)
+        x, y = absolute_position(tracker)
+        dx, dy = estimated_speed(tracker)
+        return (x + dx * elapsed, y + dy * elapsed)
+
+    def _reaches(self, scene, position):
+        r = self.radius
+        return (
+            scene.x0 - r <= position[0] <= scene.x1 + r
+            and scene.y0 - r <= position[1] <= scene.y1 + r
+        )
+
+    def offer(self, idx, tracker, frame_cnt):
+        """
+        Hands an out-of-scene tracker of the scene idx over to its neighbours
+        Returns: the tracker of the neighbour which took the state or None if
+        the handoff is pending
+        """
+        roi = world_roi(tracker)
+        for n in self._graph.neighbours(idx):
+            adopted = self._scenes[n].adopt(tracker, roi)
+            if not adopted is None:
+                self.stats["direct"] += 1
+                return adopted
+
+        position = self._predict(tracker, frame_cnt)
+        deadline = frame_cnt + self.window
+        for n in self._graph.neighbours(idx):
+            if self._reaches(self._scenes[n], position):
+                self._pending[n][tracker.uid] = (tracker, deadline)
+        return None
+
+    def claim(self, idx, tracker, frame_cnt):
+        """
+        Looks for a pending handoff for a new tracker of the scene idx
+        Returns: the out-of-scene tracker to take the state from (or None)
+        """
+        pending = self._pending[idx]
+        if len(pending) == 0:
+            return None
+
+        (x1, y1), (x2, y2) = world_roi(tracker)
+        x, y = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        best = None
+        best_distance = self.radius * self.radius
+        for source, deadline in pending.values():
+            px, py = self._predict(source, frame_cnt)
+            distance = (px - x) * (px - x) + (py - y) * (py - y)
+            if distance <= best_distance:
+                best = source
+                best_distance = distance
+
+        if not best is None:
+            self.cancel(best)
+            self.stats["relinked"] += 1
+        return best
+
+    def cancel(self, tracker):
+        """
+        Drops the pending handoffs of the tracker
+        """
+        for pending in self._pending:
+            pending.pop(tracker.uid, None)
+
+    def expire(self, registry, frame_cnt):
+        """
+        Drops the pending handoffs whose window is over or whose tracker is
+        not in the out-of-scene pool anymore
+        """
+        dropped = set()
+        for pending in self._pending:
+            for uid, (tracker, deadline) in list(pending.items()):
+                if deadline >= frame_cnt and registry.contains(
+                    tracker, Registry.OUT
+                ):
+                    continue
+                del pending[uid]
+                dropped.add(uid)
+        self.stats["dropped"] += len(dropped)
+
+    def __len__(self):
+        uids = set()
+        for pending in self._pending:
+            uids.update(pending.keys())
+        return len(uids)
@@ -23,7 +23,6 @@
 # Master in High-Performance Computing - SISSA
 
 import argparse
-import cv2 as cv
 import sys
 import time
 
@@ -36,9 +35,17 @@ sys.path.append("../Utils/")
 import Playground.generator as Generator
 import GlobalTracker.world as World
 import GlobalTracker.utils as Utils
+import GlobalTracker.tiling as Tiling
 import Utils.json_settings as Settings
+from Utils.recorder import Recorder
+import Utils.viewer as Viewer
 
 def main(args):
+  # Headless: no drawing at all
+  if args.headless:
+    args.display = False
+    args.record = False
+
   # Open Settings
   settings = Settings.Settings("playground.json")
   if not settings.is_valid():
@@ -48,10 +55,17 @@ def main(args):
   # Generate the world
   world_size = settings.set_if_defined("world_size", args.world_size)
 
-  my_world = Generator.World(playground_size=world_size,
-                          mitosis=args.mitosis_rate,
-                          instances=args.number_of_instances,
-                          frames=args.frames)
+  if args.array_world:
+    my_world = Generator.ArrayWorld(playground_size=world_size,
+                                    mitosis=args.mitosis_rate,
+                                    instances=args.number_of_instances,
+                                    frames=args.frames,
+                                    seed=args.seed)
+  else:
+    my_world = Generator.World(playground_size=world_size,
+                            mitosis=args.mitosis_rate,
+                            instances=args.number_of_instances,
+                            frames=args.frames)
 
   # Attach world tracker
   tracking_world = World.World(settings)
@@ -60,42 +74,76 @@ def main(args):
   scene_size = settings.set_if_defined("scene_size", args.scene_size)
   overlapping = settings.set_if_defined("overlapping", args.overlapping)
 
-  rois = Utils.build_rois(scene_size, overlapping)
-  tracking_world.spawn_scenes(rois, overlapping, \
+  tiles = settings.set_if_defined("tiles", args.tiles)
+  tiling = Tiling.grid(scene_size, overlapping, tiles, world_size=world_size)
+  rois = tiling.rois
+  tracking_world.spawn_scenes(tiling, overlapping, \
     args.sampling_rate_detection)
 
   if args.record:
-    fourcc = cv.VideoWriter_fourcc(*'MP4V')
-    record = cv.VideoWriter('./video.mp4',fourcc, 25, (1400,1200), True)
+    record = Recorder('./video.mp4', (world_size[1], world_size[0]),
+                      25 / args.record_decimation,
+                      policy=args.record_policy,
+                      decimation=args.record_decimation,
+                      scale=args.record_scale)
+
+  # The display runs in another process fed through shared memory
+  viewer = Viewer.create(args.display, (world_size[0], world_size[1], 3), "World")
+
+  # Per-tile rendering: the world canvas is only stitched to be shown
+  if args.tile_render:
+    renderer = Generator.TileRenderer(rois, world_size)
+    stitcher = Tiling.Stitcher(tiling)
 
   # Run the simulation
+  render = args.display or args.record
+  frame_idx = 0
   while(my_world.update()):
-    drawing = my_world.draw()
-    frames = []
-    for i in range(len(rois)):
-      # Refresh scene
-      frames.append(Generator.getFrame(rois[i], drawing))
+    if args.tile_render:
+      frames = renderer.render(my_world)
+    else:
+      drawing = my_world.draw()
+      # Refresh scenes
+      frames = tiling.crop_all(drawing)
 
     # Update scenes
     tracking_world.update_trackers(frames)
-
-    # Draw rectange overlay to determine where are the ROIS
-    Utils.draw_roi(drawing, rois)
-
-    # Label the world objects
-    world_labeled = tracking_world.draw_trackers(drawing)
+    frame_idx += 1
+
+    # Nothing to show: skip the drawing and the player delay
+    if not render:
+      continue
+
+    if args.tile_render:
+      # The tile buffers are reused: they are rewritten in every frame
+      drawing = stitcher.stitch(frames, changed=[True] * len(frames))
+      # The canvas is persistent: the overlays go on a copy
+      world_labeled = tracking_world.draw_trackers(drawing)
+      Utils.draw_roi(world_labeled, rois)
+    else:
+      # Draw rectange overlay to determine where are the ROIS
+      Utils.draw_roi(drawing, rois)
+
+      # Label the world objects (the playground frame is not reused)
+      world_labeled = tracking_world.draw_trackers(drawing, inplace=True)
     
     if args.display:
-      cv.imshow("World", world_labeled)
-      cv.waitKey(1)
+      stats = tracking_world.tracker_counts()
+      stats["frame"] = frame_idx
+      viewer.publish(world_labeled, stats)
 
     if args.record:
       record.write(world_labeled)
 
     time.sleep(args.delay_player)
   
+  viewer.close()
+  tracking_world.save_detections()
+  if not tracking_world.detection_stats() is None:
+    print('Detection cache:', tracking_world.detection_stats())
   if args.record:
     record.release()
+    print('Recording:', record.stats)
 
 
 if __name__ == "__main__":
@@ -106,6 +154,8 @@ if __name__ == "__main__":
                       help='Size of the world (h, w, chans)', default=(1200,1400,3))
   parser.add_argument('--scene_size', type=object,
                       help='Size of the scene within the world (h, w)', default=(480, 640))
+  parser.add_argument('--tiles', type=int, nargs=2,
+                      help='Grid of scenes (rows, cols)', default=(2, 2))
   parser.add_argument('--overlapping', type=int,
                       help='Overlapping of the scene in pixels', default=20)
   parser.add_argument('--number_of_instances', type=int,
@@ -116,6 +166,14 @@ if __name__ == "__main__":
   parser.add_argument('--mitosis_rate', type=float,
                       help='Mitosis rate in probability',
                       default=0.0006)
+  parser.add_argument('--array_world',
+                      help='Vectorised playground (for large number of cells)',
+                      dest='array_world', action='store_true')
+  parser.add_argument('--tile_render',
+                      help='Render the scenes directly instead of the world',
+                      dest='tile_render', action='store_true')
+  parser.add_argument('--seed', type=int,
+                      help='Seed of the vectorised playground', default=None)
   parser.add_argument('--delay_player', type=float,
                       help='Timer delay in seconds',
                       default=0.01)
@@ -126,6 +184,18 @@ if __name__ == "__main__":
                       action='store_false')
   parser.add_argument('--record', help='Enable video recording',
                       dest='record', action='store_true')
+  parser.add_argument('--record_decimation', type=int,
+                      help='In case of recording, record one of each n frames',
+                      default=1)
+  parser.add_argument('--record_scale', type=float,
+                      help='In case of recording, downscaling of the video',
+                      default=1.0)
+  parser.add_argument('--record_policy', type=str,
+                      help='In case of recording, drop or block if the encoder is behind',
+                      default='drop')
+  parser.add_argument('--headless',
+                      help='Skip all the drawing, display, recording and delays',
+                      dest='headless', action='store_true')
   
   args = parser.parse_args()
   main(args)
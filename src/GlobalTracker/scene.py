@@ -20,9 +20,6 @@
 #
 # This project was sponsored by CNR-IOM
 
-import copy
-import cv2 as cv
-
 import LocalTracker.detector as Detector
 import LocalTracker.drawutils as DrawUtils
 import LocalTracker.tracker as Tracker
@@ -37,7 +34,9 @@ class Scene:
         overlap=0,
         detection_sampling=3,
         detection_roi=None,
-        settings=None
+        settings=None,
+        index=None,
+        detection_cache=None,
     ):
         # Get coordinates
         self.roi = ROI
@@ -48,6 +47,8 @@ class Scene:
         self.h = self.y1 - self.y0
         self.overlap = overlap
         self.frame = None
+        # Position of the scene in the world (None if standalone)
+        self.index = index
 
         # ROIs
         if detection_roi is None:
@@ -77,16 +78,35 @@ class Scene:
         self.batches = self._settings.set_if_defined("batches", 2)
         self.grayscale = self._settings.set_if_defined("grayscale", True)
         self.world_size = self._settings.set_if_defined("world_size", None)
+        self.lazy_features = self._settings.set_if_defined("lazy_features", False)
+        self.lazy_margin = self._settings.set_if_defined("lazy_features_margin", 32)
+        self.lazy_refresh = self._settings.set_if_defined("lazy_features_refresh", 10)
 
         self.counter = 0
         self.detection_sampling = detection_sampling
+        # Detections of previous runs (shared by the scenes of the world)
+        self.detection_cache = detection_cache
+        self._canvas = None
 
     def load_frame(self, frame):
         self.frame = frame
 
     def detect(self, gray_frame):
         padding = self._settings.set_if_defined("padding", None)
-        return Detector.detect(gray_frame, self.batches, padding=padding)
+        cache = self.detection_cache
+        if not cache is None:
+            key = cache.key(gray_frame, (self.batches, padding))
+            detections = cache.get(key)
+            if not detections is None:
+                return detections
+
+        # The detector binarises in place: never on the frame itself
+        if gray_frame is self.frame:
+            gray_frame = gray_frame.copy()
+        detections = Detector.detect(gray_frame, self.batches, padding=padding)
+        if not cache is None:
+            cache.put(key, detections)
+        return detections
 
     def track(self, colour_frame):
         Tracker.updateTrackers(colour_frame, self.trackers, ROI=self.detection_roi)
@@ -96,10 +116,9 @@ class Scene:
         if not colour_frame is None:
             self.frame = colour_frame
 
-        gray_detect = cv.cvtColor(self.frame, cv.COLOR_BGR2GRAY)
         # Perform detections and filter the new ones
         if self.counter % self.detection_sampling == 0:
-            self.detections = self.detect(gray_detect)
+            self.detections = self.detect(DrawUtils.to_gray(self.frame))
             self.new_detections = DetectionMatcher.inter_match(
                 self.detections, self.trackers
             )
@@ -112,6 +131,10 @@ class Scene:
                 offset=(self.x0, self.y0),
                 grayscale=self.grayscale,
                 world_size=self.world_size,
+                lazy=self.lazy_features,
+                lazy_margin=self.lazy_margin,
+                lazy_refresh=self.lazy_refresh,
+                scene=self.index,
             )
         else:
             self.new_detections = []
@@ -130,14 +153,61 @@ class Scene:
             self.dead_trackers,
         )
 
-    def draw(self, colour_frame):
+    def contains(self, roi):
+        """
+        Checks if a ROI in world coordinates lies within the detection zone
+        """
+        (x1, y1), (x2, y2) = roi
+        return (
+            x1 - self.x0 >= self.detection_roi[0]
+            and y1 - self.y0 >= self.detection_roi[1]
+            and x2 - self.x0 <= self.detection_roi[2]
+            and y2 - self.y0 <= self.detection_roi[3]
+        )
+
+    def adopt(self, tracker, roi, threshold={"iom": 0.25, "cd": 64}):
+        """
+        Looks for the tracker of this scene which already follows the cell
+        on a ROI in world coordinates (same criterion as the detections, see
+        DetectionMatcher.inter_match) and makes it inherit the state of a
+        tracker from another scene
+        Returns: the tracker or None if the cell is not tracked here
+        """
+        (x1, y1), (x2, y2) = roi
+        local = ((x1 - self.x0, y1 - self.y0), (x2 - self.x0, y2 - self.y0))
+        best = None
+        best_overlap = None
+        for candidate in self.trackers:
+            if candidate.is_dead or candidate.out_roi or candidate.roi is None:
+                continue
+            iom = DetectionMatcher.calculate_iom(local, candidate.roi)
+            cd = DetectionMatcher.calculate_cd(local, candidate.roi)
+            if iom <= threshold["iom"] and cd >= threshold["cd"]:
+                continue
+            overlap = (iom, -cd)
+            if best is None or overlap > best_overlap:
+                best = candidate
+                best_overlap = overlap
+        if best is None:
+            return None
+        best.inherit(tracker)
+        return best
+
+    def draw(self, colour_frame, inplace=False):
         """
         Purple: New detections
         Red: Detections
         Blue: Trackers
         Light blue: Out of scene
+
+        The overlay is drawn on a copy of the frame, which is a buffer reused
+        by the next call (or on the frame itself if inplace)
         """
-        colour_copy = copy.deepcopy(colour_frame)
+        if inplace:
+            colour_copy = colour_frame
+        else:
+            self._canvas = DrawUtils.copy_to_buffer(colour_frame, self._canvas)
+            colour_copy = self._canvas
         # Draw detections
         colour_copy = DrawUtils.draw_detections(
             colour_copy, self.new_detections, (255, 0, 255)
@@ -0,0 +1,304 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- A tiling is the layout of the scenes within the world. The ROIs follow
+  the scene convention: ((x0, x1), (y0, y1)) in world coordinates
+- The regular grids are row-major: the scene (row, col) is the number
+  row * cols + col
+- The placements are precomputed: for each scene, the slices of the world
+  and of the scene frame which map to each other (clipped to the world)
+- In the overlapping bands, the last scene written wins. The stitcher
+  splits the bands instead (midpoint for grids, closest centre otherwise),
+  so each world pixel has a single owner
+"""
+
+import numpy as np
+
+
+def grid_rois(scene_size, overlapping=0, shape=(2, 2), origin=(0, 0)):
+    """
+    Builds the ROIs of a regular grid of scenes
+
+    Params:
+    * scene_size: (h, w) of each scene
+    * overlapping: pixels shared by two adjacent scenes
+    * shape: (rows, cols) of the grid
+    * origin: (x, y) of the first scene in the world
+
+    Returns: list([[x0, x1],[y0, y1]]) in row-major order
+    """
+    h, w = scene_size[0:2]
+    rows, cols = shape
+    x0, y0 = origin
+    h_p = h - overlapping
+    w_p = w - overlapping
+
+    rois = []
+    for j in range(rows):
+        for i in range(cols):
+            x1 = x0 + i * w_p
+            y1 = y0 + j * h_p
+            rois.append(((x1, x1 + w), (y1, y1 + h)))
+    return rois
+
+
+def bounding_size(rois):
+    """
+    Computes the size (h, w) of the world which contains all the ROIs
+    """
+    h = max([roi[1][1] for roi in rois])
+    w = max([roi[0][1] for roi in rois])
+    return (h, w)
+
+
+class Tiling:
+    def __init__(self, rois, world_size=None, shape=None):
+        """
+        Params:
+        * rois: list([[x0, x1],[y0, y1]]). Irregular layouts are allowed
+        * world_size: (h, w) of the world. By default, the bounding size
+        * shape: (rows, cols) if it is a regular grid
+        """
+        if world_size is None:
+            world_size = bounding_size(rois)
+
+        self.rois = list(rois)
+        self.world_size = tuple(world_size[0:2])
+        self.shape = shape
+        self.placements = [self._placement(roi) for roi in self.rois]
+
+    def _placement(self, roi):
+        """
+        Computes the slices (world, scene) for a ROI. None if the ROI is
+        completely out of the world
+        """
+        H, W = self.world_size
+        (x0, x1), (y0, y1) = roi
+        wx0, wx1 = max(x0, 0), min(x1, W)
+        wy0, wy1 = max(y0, 0), min(y1, H)
+        if wx0 >= wx1 or wy0 >= wy1:
+            return None
+
+        world = (slice(wy0, wy1), slice(wx0, wx1))
+        scene = (slice(wy0 - y0, wy1 - y0), slice(wx0 - x0, wx1 - x0))
+        return (world, scene)
+
+    def scene_size(self, idx):
+        """
+        Returns the size (h, w) of the scene idx
+        """
+        (x0, x1), (y0, y1) = self.rois[idx]
+        return (y1 - y0, x1 - x0)
+
+    def crop(self, world, idx):
+        """
+        Returns the view of the world which corresponds to the scene idx
+        """
+        placement = self.placements[idx]
+        if placement is None:
+            return None
+        return world[placement[0]]
+
+    def crop_all(self, world):
+        """
+        Splits the world into the scene frames (views, not copies)
+        """
+        return [self.crop(world, i) for i in range(len(self.rois))]
+
+    def stitch(self, frames, canvas=None):
+        """
+        Places the scene frames in the world
+
+        Params:
+        * frames: list with a frame per scene (in the order of the ROIs)
+        * canvas: world frame to write in. If None, it is allocated
+
+        Returns: canvas
+        """
+        if canvas is None:
+            H, W = self.world_size
+            canvas = np.zeros((H, W, 3), dtype=np.uint8)
+
+        for placement, frame in zip(self.placements, frames):
+            if placement is None or frame is None:
+                continue
+            world, scene = placement
+            canvas[world] = frame[scene]
+        return canvas
+
+    def __len__(self):
+        return len(self.rois)
+
+
+def grid(scene_size, overlapping=0, shape=(2, 2), origin=(0, 0), world_size=None):
+    """
+    Builds the tiling of a regular grid of scenes (see grid_rois)
+    """
+    rois = grid_rois(scene_size, overlapping, shape, origin)
+    return Tiling(rois, world_size, tuple(shape))
+
+
+class Stitcher:
+    def __init__(self, tiling, channels=3, dtype=np.uint8):
+        """
+        Stitches the scene frames into a persistent world canvas. Each world
+        pixel is owned by the scene whose centre is the closest, so the
+        overlapping bands are split and the tiles can be written
+        independently (and skipped if they did not change)
+
+        Params:
+        * tiling: layout of the scenes
+        * channels: channels of the canvas (grayscale frames are broadcast)
+        """
+        H, W = tiling.world_size
+        self.tiling = tiling
+        self.channels = channels
+        if channels == 1:
+            self.canvas = np.zeros((H, W), dtype=dtype)
+        else:
+            self.canvas = np.zeros((H, W, channels), dtype=dtype)
+        if tiling.shape is None:
+            self.placements = self._own(tiling)
+        else:
+            self.placements = self._own_grid(tiling)
+        self._sources = [None] * len(tiling)
+
+    def _own_grid(self, tiling):
+        """
+        Computes the region owned by each scene of a grid: the overlapping
+        bands are split by the middle. Returns (world slice, scene slice,
+        None) per scene
+        """
+        H, W = tiling.world_size
+        rows, cols = tiling.shape
+        placements = []
+        for idx, roi in enumerate(tiling.rois):
+            (x0, x1), (y0, y1) = roi
+            row, col = idx // cols, idx % cols
+            # Cut at the middle of the bands shared with the neighbours
+            ox0, ox1, oy0, oy1 = x0, x1, y0, y1
+            if col > 0:
+                ox0 = (tiling.rois[idx - 1][0][1] + x0) // 2
+            if col < cols - 1:
+                ox1 = (x1 + tiling.rois[idx + 1][0][0]) // 2
+            if row > 0:
+                oy0 = (tiling.rois[idx - cols][1][1] + y0) // 2
+            if row < rows - 1:
+                oy1 = (y1 + tiling.rois[idx + cols][1][0]) // 2
+            ox0, ox1 = max(ox0, 0), min(ox1, W)
+            oy0, oy1 = max(oy0, 0), min(oy1, H)
+            if ox0 >= ox1 or oy0 >= oy1:
+                placements.append(None)
+                continue
+            world = (slice(oy0, oy1), slice(ox0, ox1))
+            scene = (slice(oy0 - y0, oy1 - y0), slice(ox0 - x0, ox1 - x0))
+            placements.append((world, scene, None))
+        return placements
+
+    def _own(self, tiling):
+        """
+        Computes the region owned by each scene of an irregular layout:
+        (world slice, scene slice, mask). The mask is None when the region
+        is a rectangle
+        """
+        H, W = tiling.world_size
+        owner = np.full((H, W), -1, dtype=np.int32)
+        distance = np.full((H, W), np.inf, dtype=np.float32)
+        for idx, placement in enumerate(tiling.placements):
+            if placement is None:
+                continue
+            world, scene = placement
+            (x0, x1), (y0, y1) = tiling.rois[idx]
+            ys = np.arange(world[0].start, world[0].stop, dtype=np.float32)
+            xs = np.arange(world[1].start, world[1].stop, dtype=np.float32)
+            d = np.maximum(
+                np.abs(ys - (y0 + y1) / 2.0)[:, None] / max(y1 - y0, 1),
+                np.abs(xs - (x0 + x1) / 2.0)[None, :] / max(x1 - x0, 1),
+            )
+            closer = d < distance[world]
+            distance[world][closer] = d[closer]
+            owner[world][closer] = idx
+
+        placements = []
+        for idx, placement in enumerate(tiling.placements):
+            if placement is None:
+                placements.append(None)
+                continue
+            owned = np.argwhere(owner == idx)
+            if owned.shape[0] == 0:
+                placements.append(None)
+                continue
+            (y0, x0), (y1, x1) = owned.min(axis=0), owned.max(axis=0) + 1
+            world = (slice(y0, y1), slice(x0, x1))
+            (rx0, rx1), (ry0, ry1) = tiling.rois[idx]
+            scene = (slice(y0 - ry0, y1 - ry0), slice(x0 - rx0, x1 - rx0))
+            mask = owner[world] == idx
+            if mask.all():
+                mask = None
+            placements.append((world, scene, mask))
+        return placements
+
+    def _write(self, placement, frame):
+        world, scene, mask = placement
+        tile = frame[scene]
+        target = self.canvas[world]
+        if tile.ndim == 2 and target.ndim == 3:
+            tile = tile[:, :, None]
+        elif tile.ndim == 3 and target.ndim == 2:
+            tile = tile[:, :, 0]
+        if mask is None:
+            target[...] = tile
+        else:
+            target[mask] = tile[mask]
+
+    def stitch(self, frames, changed=None):
+        """
+        Writes the scene frames in the canvas in place
+
+        Params:
+        * frames: list with a frame per scene (in the order of the ROIs)
+        * changed: list of booleans. By default, a scene is rewritten when
+          its frame is a different object than in the previous call
+
+        Returns: canvas (the same array in every call)
+        """
+        for idx, frame in enumerate(frames):
+            placement = self.placements[idx]
+            if placement is None or frame is None:
+                continue
+            if changed is None:
+                if frame is self._sources[idx]:
+                    continue
+            elif not changed[idx]:
+                continue
+            self._write(placement, frame)
+            self._sources[idx] = frame
+        return self.canvas
+
+    def invalidate(self):
+        """
+        Forces the rewrite of all the scenes in the next stitching (i.e.
+        after drawing on the canvas)
+        """
+        self._sources = [None] * len(self._sources)
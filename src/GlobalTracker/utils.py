@@ -23,7 +23,8 @@
 # Master in High-Performance Computing - SISSA
 
 import cv2 as cv
-import numpy as np
+
+import tiling as Tiling
 
 def draw_roi(world, rois):
     for roi in rois:
@@ -32,29 +33,20 @@ def draw_roi(world, rois):
     return world
 
 
-def build_rois(roi_size, overlapping):
-    h, w = roi_size
-    h_p = h - overlapping
-    w_p = w - overlapping
-
-    ROIS = [
-        ((0, w), (0, h)),
-        ((w_p, w_p + w), (0, h)),
-        ((0, w), (h_p, h_p + h)),
-        ((w_p, w_p + w), (h_p, h_p + h)),
-    ]
-    return ROIS
-
+def build_rois(roi_size, overlapping, shape=(2, 2)):
+    """
+    Builds the ROIs of a grid of scenes (2x2 by default)
+    Params: roi_size (h, w), overlapping in pixels, shape (rows, cols)
+    Returns: list([[x0, x1],[y0, y1]])
+    """
+    return Tiling.grid_rois(roi_size, overlapping, shape)
 
-def naive_stitch(frames, world_size, scene_size, order):
-    # Create the canvas
-    h, w = world_size
-    world = np.zeros((h, w, 3), dtype=np.uint8)
-    h, w = scene_size
 
-    for i in range(len(order)):
-        x = w * (i % 2)
-        y = h * (i // 2)
-        world[y:y+h, x:x+w] = frames[order[i]]
-
-    return world
+def naive_stitch(frames, world_size, scene_size, order, cols=2):
+    """
+    Stitches the frames side by side (without overlapping) in a grid of
+    cols columns. The scene order[i] goes to the i-th place of the grid
+    """
+    rows = (len(order) + cols - 1) // cols
+    tiling = Tiling.grid(scene_size, 0, (rows, cols), world_size=world_size)
+    return tiling.stitch([frames[i] for i in order])
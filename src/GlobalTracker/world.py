@@ -20,48 +20,150 @@
 #
 # This project was sponsored by CNR-IOM
 
-import copy
-
 import scene as Scene
+from adjacency import SceneGraph
+from handoff import Handoff
+import tiling as Tiling
 import Matcher.matcher as GlobalMatcher
+import Matcher.registry as Registry
+from Matcher.gating import SpatialGate
+from Matcher.index import AppearanceIndex
 import LocalTracker.drawutils as DrawUtils
+from LocalTracker.detection_cache import DetectionCache
 
 
 class World:
     def __init__(self, settings=None):
         self._settings = settings
         self._scenes = []
-        self._new_trackers = []
-        self._current_trackers = []
-        self._out_trackers = []
-        self._dead_trackers = []
+        self._tiling = None
+        self._registry = Registry.Registry()
         self._last_id = 0
         self._frame_cnt = 0
         self._tracer = None
+        self._recorder = None
+        self._canvas = None
+        self._graph = None
+        self._handoff = None
+        self._detection_cache = None
 
         if settings is None:
             raise RuntimeError("World settings are not valid")
 
-    def spawn_scenes(self, rois, overlapping=0, sampling_rate=3):
+        # Matchers: out-of-scene and dead trackers
+        self._global_matcher = self._create_matcher("global_matcher", Registry.OUT)
+        self._dead_matcher = self._create_matcher("dead_tracker", Registry.DEAD)
+
+    def _create_matcher(self, prefix, pool):
+        """
+        Creates a matcher for the given pool, taking the settings that start
+        with prefix
+        """
+        settings = self._settings
+        weights = settings.set_if_defined(prefix + "_weights", None)
+        threshold = settings.set_if_defined(prefix + "_threshold", None)
+        death_time = settings.set_if_defined(prefix + "_death_time", None)
+        pool_size = settings.set_if_defined(prefix + "_pool_size", None)
+        world_size = settings.set_if_defined("world_size", None)
+
+        gate = None
+        gate_radius = settings.set_if_defined(prefix + "_gate_radius", None)
+        if not gate_radius is None:
+            gate = SpatialGate(
+                gate_radius,
+                settings.set_if_defined(prefix + "_gate_growth", 1.0),
+                settings.set_if_defined(prefix + "_gate_max_radius", None),
+            )
+
+        index = None
+        top_k = settings.set_if_defined(prefix + "_index_top_k", None)
+        if not top_k is None:
+            index = AppearanceIndex(
+                weights,
+                top_k,
+                settings.set_if_defined(prefix + "_index_lists", 16),
+                settings.set_if_defined(prefix + "_index_probes", 3),
+            )
+            # Nothing to index without positive appearance weights
+            if not index.is_valid():
+                index = None
+
+        workers = settings.set_if_defined(prefix + "_workers", 1)
+
+        return GlobalMatcher.Matcher(
+            weights,
+            threshold,
+            death_time,
+            pool,
+            pool_size,
+            world_size,
+            gate,
+            index,
+            None,
+            workers,
+        )
+
+    def spawn_scenes(self, rois, overlapping=0, sampling_rate=3, scene_factory=None):
         """
         Creates the scenes by setting the ROIS (extrinsic parameter for the
         external reference system)
 
         Params:
-        * rois: list([[x0, x1],[y0, y1]])
+        * rois: list([[x0, x1],[y0, y1]]) or a tiling
         * overlapping: pixels of overlapping
         * sampling_rate: how many times the detector is deployed
+        * scene_factory: function (roi, index) -> scene. It replaces the
+          scenes which track the frames (i.e. by replayed scenes)
 
         Return: None
         """
-        for roi in rois:
+        if hasattr(rois, "placements"):
+            self._tiling = rois
+        else:
+            world_size = self._settings.set_if_defined("world_size", None)
+            self._tiling = Tiling.Tiling(rois, world_size)
+
+        # Detections cached on disk across runs
+        cache_path = self._settings.set_if_defined("detection_cache", None)
+        if not cache_path is None:
+            self._detection_cache = DetectionCache(cache_path)
+
+        for roi in self._tiling.rois:
+            if not scene_factory is None:
+                self._scenes.append(scene_factory(roi, len(self._scenes)))
+                continue
             self._scenes.append(
                 Scene.Scene(
                     ROI=roi, overlap=overlapping, detection_sampling=sampling_rate, 
-                    settings=self._settings
+                    settings=self._settings, index=len(self._scenes),
+                    detection_cache=self._detection_cache,
                 )
             )
 
+        # Scene adjacency: the matching is restricted to the neighbourhoods
+        hops = self._settings.set_if_defined("scene_graph_hops", None)
+        self._graph = SceneGraph(
+            [scene.roi for scene in self._scenes], 1 if hops is None else hops
+        )
+        if not hops is None:
+            self._global_matcher.graph = self._graph
+            self._dead_matcher.graph = self._graph
+
+        # Cross-scene handoff through the overlapping bands
+        if self._settings.set_if_defined("handoff", False):
+            self._handoff = Handoff(
+                self._scenes,
+                self._graph,
+                self._settings.set_if_defined("handoff_radius", 96),
+                self._settings.set_if_defined("handoff_window", 30),
+            )
+
+    def tiling(self):
+        """
+        Returns the layout of the scenes in the world
+        """
+        return self._tiling
+
     def load_frames(self, frames):
         """
         Load the frames to the scenes without performing any update
@@ -78,66 +180,88 @@ class World:
         in the world and link them in a similar fashion to the out-of-scene
         This perform operations on: current, new, and dead trackers
         '''
-
-        weights = self._settings.set_if_defined("dead_tracker_weights", None)
-        threshold = self._settings.set_if_defined("dead_tracker_threshold", None)
-        death_time = self._settings.set_if_defined("dead_tracker_death_time", None)
-        match_instance = GlobalMatcher.Matcher(weights, threshold, death_time)
-
-        # Perform matching
-        return match_instance.match(
-            self._current_trackers, self._new_trackers, self._dead_trackers
-        )
+        return self._dead_matcher.match(self._registry, self._frame_cnt)
 
     def _update_current_trackers(self):
         """
         Updates the current trackers list, removing those trackers which
         requires to be analysed for matching
         """
-        self._frame_cnt += 1
-
-        weights = self._settings.set_if_defined("global_matcher_weights", None)
-        threshold = self._settings.set_if_defined("global_matcher_threshold", None)
-        death_time = self._settings.set_if_defined("global_matcher_death_time", None)
-        match_instance = GlobalMatcher.Matcher(weights, threshold, death_time)
-
-        # Perform cleaning of replicates - this avoids redundancies
-        (
-            self._current_trackers,
-            self._new_trackers,
-            self._out_trackers,
-            self._dead_trackers,
-        ) = match_instance.pre_clean(
-            self._current_trackers,
-            self._new_trackers,
-            self._out_trackers,
-            self._dead_trackers,
-        )
+        # Retire the trackers whose time in the pools is over
+        self._dead_matcher.expire(self._registry, self._frame_cnt)
+        self._global_matcher.expire(self._registry, self._frame_cnt)
 
         # Link dead trackers first
-        res = self._find_dead_trackers()
-        self._current_trackers, self._new_trackers, self._dead_trackers = res
+        self._find_dead_trackers()
 
         # Perform matching - out of scene
-        res = match_instance.match(
-            self._current_trackers, self._new_trackers, self._out_trackers
-        )
-        self._current_trackers, self._new_trackers, self._out_trackers = res
+        self._global_matcher.match(self._registry, self._frame_cnt)
 
         # Perform post cleaning
-        (
-            self._last_id,
-            self._current_trackers,
-            self._new_trackers,
-            self._out_trackers,
-        ) = match_instance.post_clean(
-            self._current_trackers,
-            self._new_trackers,
-            self._out_trackers,
-            self._last_id,
-            self._frame_cnt,
+        self._last_id = self._global_matcher.post_clean(
+            self._registry, self._last_id, self._frame_cnt
         )
 
+    def _register_trackers(self, new, out, dead):
+        """
+        Performs the state transitions of the trackers reported by a scene.
+        A tracker is only in one state, so there are no replicates
+        """
+        registry = self._registry
+
+        for tracker in new:
+            registry.move(tracker, Registry.NEW)
+
+        for tracker in out:
+            if registry.contains(tracker, Registry.DEAD):
+                self._dead_matcher.retire(registry, tracker)
+            self._global_matcher.admit(registry, tracker, self._frame_cnt)
+
+        for tracker in dead:
+            state = registry.state(tracker)
+            if state == Registry.NEW or state == Registry.CURRENT:
+                self._dead_matcher.admit(registry, tracker, self._frame_cnt)
+
+    def _take_over(self, tracker, source):
+        """
+        Replaces an out-of-scene tracker by the tracker which took its state
+        in another scene
+        """
+        registry = self._registry
+        source.timeout = 0
+        self._global_matcher.retire(registry, source)
+        if tracker.label is None:
+            registry.move(tracker, Registry.NEW)
+        else:
+            registry.move(tracker, Registry.CURRENT)
+
+    def _hand_over(self, reported):
+        """
+        Hands the out-of-scene trackers over to the neighbouring scenes and
+        lets the new trackers claim the pending handoffs
+        Params: reported: list([new, out]) per scene
+        """
+        registry = self._registry
+        handoff = self._handoff
+        handoff.expire(registry, self._frame_cnt)
+
+        for idx, (new, out) in enumerate(reported):
+            for tracker in out:
+                if not registry.contains(tracker, Registry.OUT):
+                    continue
+                adopted = handoff.offer(idx, tracker, self._frame_cnt)
+                if not adopted is None:
+                    self._take_over(adopted, tracker)
+
+        for idx, (new, out) in enumerate(reported):
+            for tracker in new:
+                if not registry.contains(tracker, Registry.NEW):
+                    continue
+                source = handoff.claim(idx, tracker, self._frame_cnt)
+                if not source is None:
+                    tracker.inherit(source)
+                    self._take_over(tracker, source)
+
     def update_trackers(self, frames=None):
         """
         Updates the scene and its trackers
@@ -148,25 +272,39 @@ class World:
         if not frames is None:
             self.load_frames(frames)
 
-        self._dead_trackers = list([])
-        for scene in self._scenes:
+        self._frame_cnt += 1
+        reported = []
+        for idx, scene in enumerate(self._scenes):
             cur, out, new, dead = scene.update()
-            self._new_trackers += new
-            self._out_trackers += out
-            self._dead_trackers += dead
+            # Recorded before the world freezes or relabels them
+            if not self._recorder is None:
+                self._recorder.push(idx, cur, out, new, dead)
+            self._register_trackers(new, out, dead)
+            reported.append((new, out))
+
+        if not self._recorder is None:
+            self._recorder.commit()
+
+        if not self._handoff is None:
+            self._hand_over(reported)
 
         self._update_current_trackers()
 
         # Add trace
         if not self._tracer is None:
-            self._tracer.push(self._current_trackers, self._new_trackers, \
-                self._out_trackers, self._dead_trackers)
+            registry = self._registry
+            self._tracer.push(
+                registry.get(Registry.CURRENT),
+                registry.get(Registry.NEW),
+                registry.get(Registry.OUT),
+                registry.get(Registry.DEAD),
+            )
 
     def label_scenes(self):
         """
         Draw the tracking and detection within a copy of the frame
         Params: None
-        Return: Frames in order
+        Return: Frames in order. The buffers are reused by the next call
 
         Colour code:
         Purple: New detections
@@ -176,36 +314,130 @@ class World:
         """
         frames = []
         for scene in self._scenes:
-            frame = copy.deepcopy(scene.frame)
-            frames.append(scene.draw(frame))
+            frames.append(scene.draw(scene.frame))
 
         return frames
 
-    def draw_trackers(self, world):
+    def draw_trackers(self, world, inplace=False):
         """
         Draw trackers on the world canvas
         This draws the world global tracker queues on the world canvas
 
         Params:
         * world: frame with the world
+        * inplace: draw directly on world instead of on a copy
 
         Returns:
-        * frame: copy of world with the overlay
+        * frame: copy of world with the overlay (the copy is a buffer which
+          is reused by the next call) or world if inplace
         """
 
-        frame = copy.deepcopy(world)
-        frame = DrawUtils.draw_trackers(frame, self._current_trackers, (255, 255, 255))
-        frame = DrawUtils.draw_trackers(frame, self._new_trackers, (255, 0, 0))
-        frame = DrawUtils.draw_trackers(frame, self._out_trackers, (0, 0, 255))
-        frame = DrawUtils.draw_trackers(frame, self._dead_trackers, (255, 0, 255))
-        frame = DrawUtils.place_text(
-            frame, "Cur: " + str(len(self._current_trackers)), (0, 30)
+        registry = self._registry
+        current = registry.get(Registry.CURRENT)
+        if inplace:
+            frame = world
+        else:
+            self._canvas = DrawUtils.copy_to_buffer(world, self._canvas)
+            frame = self._canvas
+        frame = DrawUtils.draw_trackers(frame, current, (255, 255, 255))
+        frame = DrawUtils.draw_trackers(
+            frame, registry.get(Registry.NEW), (255, 0, 0)
+        )
+        frame = DrawUtils.draw_trackers(
+            frame, registry.get(Registry.OUT), (0, 0, 255)
+        )
+        frame = DrawUtils.draw_trackers(
+            frame, registry.get(Registry.DEAD), (255, 0, 255)
         )
+        frame = DrawUtils.place_text(frame, "Cur: " + str(len(current)), (0, 30))
         return frame
 
+    def matcher_stats(self):
+        """
+        Returns the statistics of the global matchers (pools)
+        """
+        stats = {}
+        for name, matcher in (
+            ("global", self._global_matcher),
+            ("dead", self._dead_matcher),
+        ):
+            stats[name] = dict(matcher.stats)
+        return stats
+
+    def trackers(self, state=Registry.CURRENT):
+        """
+        Returns a read-only view of the trackers in a state (current by
+        default). It follows the registry
+        """
+        return self._registry.get(state)
+
+    def tracker_counts(self):
+        """
+        Returns the number of trackers per state
+        """
+        registry = self._registry
+        return {
+            "current": registry.count(Registry.CURRENT),
+            "new": registry.count(Registry.NEW),
+            "out": registry.count(Registry.OUT),
+            "dead": registry.count(Registry.DEAD),
+        }
+
+    def handoff_stats(self):
+        """
+        Returns the statistics of the cross-scene handoff (None if disabled)
+        """
+        if self._handoff is None:
+            return None
+        stats = dict(self._handoff.stats)
+        stats["pending"] = len(self._handoff)
+        return stats
+
+    def detection_stats(self):
+        """
+        Returns the statistics of the detection cache (None if disabled)
+        """
+        if self._detection_cache is None:
+            return None
+        return self._detection_cache.report()
+
+    def save_detections(self):
+        """
+        Writes the new detections to the detection cache file
+        """
+        if not self._detection_cache is None:
+            self._detection_cache.save()
+
+    def memory_usage(self):
+        """
+        Reports the bytes used by the tracker descriptors per state
+        Returns: {state: {"trackers": count, "bytes": total}}
+        """
+        names = {
+            Registry.CURRENT: "current",
+            Registry.NEW: "new",
+            Registry.OUT: "out",
+            Registry.DEAD: "dead",
+        }
+        usage = {}
+        for state, name in names.items():
+            trackers = self._registry.get(state)
+            total = 0
+            for tracker in trackers:
+                total += tracker.memory_usage()["total"]
+            usage[name] = {"trackers": len(trackers), "bytes": total}
+        return usage
+
     def attach_tracer(self, tracer):
         self._tracer = tracer
 
+    def attach_recorder(self, recorder):
+        """
+        Attaches a recorder of the scene outputs. It gets push() per scene
+        and commit() per frame
+        """
+        self._recorder = recorder
+
     def dump_trackers(self):
         if not self._tracer is None:
             self._tracer.dump()
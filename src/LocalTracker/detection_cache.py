@@ -0,0 +1,133 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import hashlib
+import os
+
+import numpy as np
+
+"""
+Development notes:
+- The key is a 16-byte BLAKE2 digest of the detector parameters and of
+  the grayscale frame (shape and pixels), taken before the detector
+  binarises it
+- The boxes ((x1, y1), (x2, y2)) are packed as int32 rows [x1, y1, x2, y2]
+- On disk, a dataset has a single .npz file with the keys (N x 16 bytes),
+  the offsets of each entry (N + 1) and all the boxes (M x 4)
+- The file is written to a temporary file and renamed, and only if there
+  are new entries
+"""
+
+
+class DetectionCache:
+    def __init__(self, path=None):
+        """
+        Params:
+        * path: .npz file of the dataset. If None, the cache is in memory
+        """
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        self.stats = {"hits": 0, "misses": 0}
+        if not path is None and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with np.load(self.path) as data:
+            keys = data["keys"]
+            offsets = data["offsets"]
+            boxes = data["boxes"]
+        for i in range(keys.shape[0]):
+            self._entries[keys[i].tobytes()] = boxes[offsets[i] : offsets[i + 1]]
+
+    def key(self, gray_frame, params):
+        """
+        Computes the key of a frame and the detector parameters (tuple)
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((params, gray_frame.shape, str(gray_frame.dtype))).encode())
+        digest.update(np.ascontiguousarray(gray_frame).data)
+        return digest.digest()
+
+    def get(self, key):
+        """
+        Returns the boxes of the key or None if they are not cached
+        """
+        boxes = self._entries.get(key, None)
+        if boxes is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return [((int(b[0]), int(b[1])), (int(b[2]), int(b[3]))) for b in boxes]
+
+    def put(self, key, boxes):
+        packed = np.array(
+            [[p1[0], p1[1], p2[0], p2[1]] for p1, p2 in boxes], dtype=np.int32
+        ).reshape((-1, 4))
+        self._entries[key] = packed
+        self._dirty = True
+
+    def save(self):
+        """
+        Writes the cache to its file (if there are new entries)
+        """
+        if self.path is None or not self._dirty:
+            return
+        keys = list(self._entries.keys())
+        counts = [self._entries[key].shape[0] for key in keys]
+        offsets = np.zeros((len(keys) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        packed_keys = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape((-1, 16))
+        boxes = np.zeros((0, 4), dtype=np.int32)
+        if len(keys) > 0:
+            boxes = np.concatenate([self._entries[key] for key in keys])
+
+        tmp = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, keys=packed_keys, offsets=offsets, boxes=boxes)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def nbytes(self):
+        """
+        Bytes used by the cached keys and boxes
+        """
+        return sum([16 + boxes.nbytes for boxes in self._entries.values()])
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        if lookups == 0:
+            return 0.0
+        return self.stats["hits"] / lookups
+
+    def report(self):
+        """
+        Returns the statistics: hits, misses, hit rate, entries and bytes
+        """
+        stats = dict(self.stats)
+        stats["hit_rate"] = self.hit_rate()
+        stats["entries"] = len(self._entries)
+        stats["bytes"] = self.nbytes()
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
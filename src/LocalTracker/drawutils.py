@@ -22,6 +22,7 @@
 # Master in High-Performance Computing - SISSA
 
 import cv2 as cv
+import numpy as np
 
 '''
 Painting tools for tracking
@@ -89,6 +90,32 @@ def computeCenterRoi(roi):
     yc = (y2 + y1)/2.
     return (xc, yc)
 
+'''
+Colour tools
+'''
+def to_gray(frame):
+    '''
+    Returns the grayscale version of the frame. Single-channel frames are
+    returned as they are (no copy)
+    '''
+    if frame.ndim == 2:
+        return frame
+    return cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+
+'''
+Buffer tools
+'''
+def copy_to_buffer(frame, buffer=None):
+    '''
+    Copies the frame into a reusable buffer. A new buffer is only allocated
+    when the shape or the type changes
+    '''
+    if buffer is None or buffer.shape != frame.shape or \
+        buffer.dtype != frame.dtype:
+        return frame.copy()
+    np.copyto(buffer, frame)
+    return buffer
+
 '''
 World utils
 '''
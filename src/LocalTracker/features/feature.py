@@ -21,6 +21,23 @@
 # This project was sponsored by CNR-IOM
 # Master in High-Performance Computing - SISSA
 
+import numpy as np
+
+def nbytes(value):
+    '''
+    Estimates the bytes used by the numerical contents of a value: arrays,
+    numbers, containers and objects that report their memory usage
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (int, float, np.number)):
+        return 8
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(i) for i in value)
+    if hasattr(value, 'memory_usage'):
+        return value.memory_usage()
+    return 0
+
 class Feature:
     '''
     Skeleton for formating the feature and following a standard
@@ -39,3 +56,9 @@ class Feature:
 
     def compare(self, **kwargs):
         return 0.
+
+    def memory_usage(self):
+        '''
+        Bytes used by the descriptor
+        '''
+        return sum(nbytes(i) for i in vars(self).values())
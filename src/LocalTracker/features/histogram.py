@@ -39,7 +39,8 @@ class Histogram(Feature):
         self.lr = lr
 
     def _compute_histogram(self, cropped):
-        if self.grayscale:
+        # Single-channel frames only have the grayscale histogram
+        if self.grayscale or cropped.ndim == 2:
             return cv.calcHist([cropped], [0], None, self.bins, self.range)
         else:
             arr = list([])
@@ -78,7 +78,8 @@ class MosseFilter(Feature):
         self.size = None
         self.f = None
         self.PSR = 0
-        self.last_frame = None
+        # Only the patch around the target is kept (not the whole frame)
+        self.window = None
         self.center = None
 
         # Hyper-parameters
@@ -106,7 +107,6 @@ class MosseFilter(Feature):
         complex representation and allows to do Spectrum Multiplciation and
         Vision in a straight-forward fashion
         '''
-        self.last_frame = gray_image
         p1, w, h = self.extractBoundingBox(bounding_box)
         p1, p2 = bounding_box
         cols = p2[0] - p1[0]
@@ -119,6 +119,7 @@ class MosseFilter(Feature):
 
         # Get inputs - window from BBox and the HanningWindow for gaussianity
         window = cv.getRectSubPix(gray_image, self.size, self.center)
+        self.window = window
         self.hanWin = cv.createHanningWindow(self.size, cv.CV_32F)
 
         # Create goal and its FFT
@@ -150,6 +151,26 @@ class MosseFilter(Feature):
 
         return True
 
+    def _correlate(self, window):
+        '''
+        Correlates the window with the filter
+        Returns the PSR and the displacement of the peak
+        '''
+        w_f, h_f = self.size
+        f = preprocess(window, self.hanWin)
+        # Apply correlation
+        F = np.fft.fft2(f)
+        F_r = F * self.H
+        f_r = np.real(np.fft.ifft2(F_r))
+        # Find the PSR
+        minVal, maxVal, minLoc, maxLoc = cv.minMaxLoc(f_r)
+        delta_x = maxLoc[0] - w_f/2
+        delta_y = maxLoc[1] - h_f/2
+        mean = np.mean(f_r)
+        std = np.std(f_r)
+        PSR = (maxVal-mean) / (std + 0.00001)
+        return PSR, (delta_x, delta_y), f
+
     def predict(self, gray_image, bounding_box):
         '''
         Receives a grayscale frame and a bounding box and operates over it
@@ -180,33 +201,21 @@ class MosseFilter(Feature):
 
             # Align bounding boxes if needed
             if w_f != w or h_f != h:
-                p[0] = int(c[0] - (w_f/2))
-                p[1] = int(c[1] - (h_f/2))
+                p[0] = int(c0 - (w_f/2))
+                p[1] = int(c1 - (h_f/2))
 
-            self.last_frame = gray_image
+            self.window = cv.getRectSubPix(gray_image, self.size, self.center)
 
         # Get window
-        window = cv.getRectSubPix(self.last_frame, self.size, self.center)
-        self.f = preprocess(window, self.hanWin)
-        # Apply correlation
-        F = np.fft.fft2(self.f)
-        F_r = F * self.H
-        f_r = np.real(np.fft.ifft2(F_r))
-        # Find the PSR
-        minVal, maxVal, minLoc, maxLoc = cv.minMaxLoc(f_r)
-        delta_x = maxLoc[0] - w_f/2
-        delta_y = maxLoc[1] - h_f/2
-        mean = np.mean(f_r)
-        std = np.std(f_r)
-        PSR = (maxVal-mean) / (std + 0.00001)
+        PSR, delta, self.f = self._correlate(self.window)
         self.PSR = PSR
 
         # Threshold PSR
         if PSR < self.th:
             return (False, bounding_box)
 
-        x0 = p[0] + delta_x
-        y0 = p[1] + delta_y
+        x0 = p[0] + delta[0]
+        y0 = p[1] + delta[1]
 
         bbox = ((x0, y0),(x0 + w_f, y0 + h_f))
         return True, bbox
@@ -226,8 +235,6 @@ class MosseFilter(Feature):
         # Verify initialisation
         if self.H is None:
             return False
-        
-        self.last_frame = gray_image
 
         # Make prediction
         res, bbox = self.predict(gray_image, bounding_box)
@@ -239,6 +246,7 @@ class MosseFilter(Feature):
         p1, w, h = self.extractBoundingBox(bounding_box)
         self.center = (p1[0] + w/2, p1[1] + h/2)
         window_new = cv.getRectSubPix(gray_image, self.size, self.center)
+        self.window = window_new
 
         # Compute new F
         self.f = preprocess(window_new, self.hanWin)
@@ -263,17 +271,21 @@ class MosseFilter(Feature):
         To compare, it computes the similarity between the filters in order to
         see if they matches each other. The Threshold is set in times the
         defined threshold for the tracker
+
+        The patch of mosse2 is correlated with this filter. If the sizes
+        differ, the patch is re-centred to the size of this filter
         '''
-        # Back up the images
-        swap = self.last_frame
-        self.last_frame = mosse2.last_frame
-        mosse2.last_frame = swap
-        
+        if self.H is None or mosse2.window is None:
+            return np.array([1.])
+
+        window = mosse2.window
+        w_f, h_f = self.size
+        h_w, w_w = window.shape[0:2]
+        if w_f != w_w or h_f != h_w:
+            window = cv.getRectSubPix(window, self.size, (w_w/2, h_w/2))
+
         # Predict
-        self.predict(None, None)
-        
-        # Get the PSRs
-        PSR1 = self.PSR
+        PSR1, delta, f = self._correlate(window)
         
         # Get the distribution. The addition should be greater than th_t
         if PSR1 < 1.:
@@ -281,7 +293,19 @@ class MosseFilter(Feature):
         else:
             ret = 1./PSR1
         
-        mosse2.last_frame = self.last_frame
-        self.last_frame = swap
-        
-        return np.array([ret])        
+        return np.array([ret])
+
+    def snapshot(self):
+        '''
+        Compact copy of the filter which can only be compared (the training
+        buffers are not copied)
+        '''
+        mosse = MosseFilter(self.lr, self.th)
+        mosse.H = self.H
+        mosse.size = self.size
+        mosse.center = self.center
+        mosse.hanWin = self.hanWin
+        mosse.PSR = self.PSR
+        if not self.window is None:
+            mosse.window = self.window.copy()
+        return mosse
@@ -26,6 +26,7 @@ import numpy as np
 from drawutils import computeCenterRoi
 
 from features.feature import Feature
+from features.feature import nbytes
 
 
 class SpeedFeature:
@@ -50,6 +51,15 @@ class SpeedFeature:
         self.speed_vector.append(position)
         return self._compute()
 
+    def translate(self, delta):
+        """
+        Moves the collected positions to another reference system
+        """
+        self.speed_vector = [p + delta for p in self.speed_vector]
+
+    def memory_usage(self):
+        return nbytes(self.speed_vector) + nbytes(self.speed)
+
 
 class Velocity(Feature):
     def __init__(
@@ -95,6 +105,18 @@ class Velocity(Feature):
         self.position = computeCenterRoi(roi)
         return True
 
+    def translate(self, dx, dy):
+        """
+        Moves the velocity to another reference system (i.e. when a tracker
+        is handed over to another scene). The speed does not change
+        """
+        if self.speed is None:
+            return
+        self.speed[0].translate(dx)
+        self.speed[1].translate(dy)
+        if not self.position is None:
+            self.position = (self.position[0] + dx, self.position[1] + dy)
+
     def predict(self):
         return True
 
@@ -26,14 +26,32 @@
 import argparse
 import copy
 import cv2 as cv
+import sys
 import time
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.append("../")
+
 import detector
 import tracker
 import drawutils
 import matcher
+import Utils.viewer as Viewer
+
+
+def plot_features(hogs, histograms):
+    plt.figure(1)
+    plt.title("Hog features")
+    for hog in hogs:
+        if not hog is None:
+            plt.plot(hog, "-.")
+    plt.figure(2)
+    plt.title("Histogram features")
+    for histogram in histograms:
+        if not histogram is None:
+            plt.plot(histogram)
+    plt.show()
 
 
 def main(args):
@@ -41,12 +59,23 @@ def main(args):
     cap = cv.VideoCapture(args.input)
     counter = 0
     trackers = []
-
-    plt.ion()
+    hogs = []
+    histograms = []
+    stats = {}
 
     detection_roi = (10, 10, 630, 470)
     scene_size = (640, 480)
 
+    # The windows are shown by viewer processes: the loop never waits on them
+    display = not args.headless
+    original_viewer = Viewer.create(display, (240, 320, 3), "Original")
+    detection_viewer = Viewer.create(
+        display and args.draw_detection, (480, 640, 3), "Detection"
+    )
+    tracking_viewer = Viewer.create(
+        display and args.draw_tracking, (480, 640, 3), "Tracking"
+    )
+
     while cap.isOpened():
         # Grab the frame
         ret, big_frame = cap.read()
@@ -73,35 +102,23 @@ def main(args):
         tracker.updateTrackers(frame, trackers, ROI=detection_roi)
         tracking_bbs = tracker.retrieveBBs(trackers)
 
+        # Keep the features of the first trackers (plotted at the end)
         if len(trackers) > 5:
-            plt.figure(1)
-            plt.clf()
-            plt.figure(2)
-            plt.clf()
-            print(
-                "dx:",
-                round(trackers[0].velocity.speed[0].speed, 2),
-                "dy:",
-                round(trackers[0].velocity.speed[1].speed, 2),
-                "angle:",
-                round(trackers[0].velocity.direction * 180 / 3.1416, 2),
-            )
+            stats = {
+                "dx": round(float(trackers[0].velocity.speed[0].speed), 2),
+                "dy": round(float(trackers[0].velocity.speed[1].speed), 2),
+                "angle": round(
+                    float(trackers[0].velocity.direction) * 180 / 3.1416, 2
+                ),
+            }
             trackers[0].colour = (255, 0, 0)
-
-            plt.figure(1)
-            for i in range(5):
-                plt.title("Hog features")
-                if not trackers[i].hog.hog is None:
-                    plt.plot(trackers[i].hog.hog, "-.")
-            plt.figure(2)
-            for i in range(5):
-                plt.title("Histogram features")
-                if not trackers[i].histogram.histogram is None:
-                    plt.plot(trackers[i].histogram.histogram)
-            plt.draw()
+            hogs = [copy.deepcopy(trackers[i].hog.hog) for i in range(5)]
+            histograms = [
+                copy.deepcopy(trackers[i].histogram.histogram) for i in range(5)
+            ]
 
         # Draw on demand
-        if args.draw_detection:
+        if display and args.draw_detection:
             detection_bbs = detector.detect(gray_detect, ROI=detection_roi)
             detections_frame = copy.deepcopy(frame)
             detections_frame = drawutils.draw_detections(
@@ -118,9 +135,9 @@ def main(args):
                 (255, 0, 0),
                 2,
             )
-            cv.imshow("Detection", detections_frame)
+            detection_viewer.publish(detections_frame)
 
-        if args.draw_tracking:
+        if display and args.draw_tracking:
             tracking_frame = copy.deepcopy(frame)
             tracking_frame = drawutils.draw_trackers(tracking_frame, trackers)
             cv.rectangle(
@@ -137,16 +154,21 @@ def main(args):
             tracking_frame = drawutils.draw_detections(
                 tracking_frame, new_detections, (0, 0, 255)
             )
-            cv.imshow("Tracking", tracking_frame)
+            tracking_viewer.publish(tracking_frame, stats)
 
-        output_frame = cv.resize(frame, (320, 240))
-        cv.imshow("Original", output_frame)
+        if display:
+            output_frame = cv.resize(frame, (320, 240))
+            original_viewer.publish(output_frame, stats)
         counter += 1
-        cv.waitKey(1)
 
         # time.sleep(0.5)
 
-    cv.destroyAllWindows()
+    original_viewer.close()
+    detection_viewer.close()
+    tracking_viewer.close()
+
+    if display and len(hogs) > 0:
+        plot_features(hogs, histograms)
 
 
 if __name__ == "__main__":
@@ -175,6 +197,12 @@ if __name__ == "__main__":
         default=3,
     )
 
+    parser.add_argument(
+        "--headless", help="Disable all the windows", dest="headless",
+        action="store_true"
+    )
+    parser.set_defaults(headless=False)
+
     args = parser.parse_args()
 
     # Execute the main
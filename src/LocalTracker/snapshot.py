@@ -0,0 +1,79 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+# Master in High-Performance Computing - SISSA
+
+import copy
+
+from features.feature import nbytes
+
+
+class DescriptorSnapshot:
+    """
+    Immutable and compact copy of the descriptors of a tracker. It is taken
+    when the tracker goes out of scene or dies, so the matcher compares
+    against it instead of the live tracker. It exposes the same attributes
+    used by the matcher: histogram, hog, mosse, velocity, position,
+    roi_offset, uid and version
+    """
+
+    def __init__(self, tracker):
+        values = {
+            "uid": tracker.uid,
+            "version": tracker.version,
+            "label": tracker.label,
+            "roi": tracker.roi,
+            "roi_offset": tracker.roi_offset,
+            "position": tracker.position,
+            "samples": tracker.samples,
+            "sample_bins": tracker.sample_bins,
+            "histogram": copy.deepcopy(tracker.histogram),
+            "hog": copy.deepcopy(tracker.hog),
+            "velocity": copy.deepcopy(tracker.velocity),
+            "mosse": tracker.mosse.snapshot(),
+        }
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Descriptor snapshots are immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("Descriptor snapshots are immutable")
+
+    def descriptors(self):
+        """
+        Returns the object to compare with (the snapshot itself)
+        """
+        return self
+
+    def memory_usage(self):
+        """
+        Bytes used by the descriptors of the snapshot
+        """
+        return (
+            self.histogram.memory_usage()
+            + self.hog.memory_usage()
+            + self.velocity.memory_usage()
+            + self.mosse.memory_usage()
+            + nbytes(self.roi)
+            + nbytes(self.position)
+        )
@@ -24,13 +24,34 @@
 import numpy as np
 import copy
 import cv2 as cv
+import itertools
 
 from drawutils import crop_roi
 from drawutils import computeCenterRoi
+from drawutils import to_gray
 from features.mosse import MosseFilter
 from features.hog import Hog
 from features.histogram import Histogram
 from features.velocity import Velocity
+from snapshot import DescriptorSnapshot
+
+# Stable identifiers for the trackers (used by the global registry)
+_uid_counter = itertools.count(1)
+
+
+def _create_kcf(frame=None):
+    """
+    Creates the OpenCV tracker. The default features (colour names) require
+    three channels, so the single-channel frames use the grayscale ones
+    """
+    if frame is None or frame.ndim == 3:
+        return cv.TrackerKCF_create()
+    params = cv.TrackerKCF_Params()
+    params.desc_pca = cv.TrackerKCF_GRAY
+    params.desc_npca = cv.TrackerKCF_GRAY
+    params.compress_feature = False
+    params.compressed_size = 1
+    return cv.TrackerKCF_create(params)
 
 
 def computeTrackerRoi(roi):
@@ -43,9 +64,21 @@ def computeTrackerRoi(roi):
 
 class Tracker:
     def __init__(
-        self, colour, grayscale=True, timeout=50, offset=None, world_size=None
+        self,
+        colour,
+        grayscale=True,
+        timeout=50,
+        offset=None,
+        world_size=None,
+        lazy=False,
+        lazy_margin=32,
+        lazy_refresh=10,
+        scene=None,
     ):
-        self.tracker = cv.TrackerKCF_create()
+        self.tracker = _create_kcf()
+        self.uid = next(_uid_counter)
+        # Index of the scene which deployed the tracker
+        self.scene = scene
         self.colour = colour
         self.roi = None
         self.orig_roi = None
@@ -63,12 +96,21 @@ class Tracker:
         self.sample_bins = 15
         self.histo_lr = 0.1
 
+        # Lazy features: the appearance descriptors are only refreshed every
+        # frame when the tracker may be matched soon (new, close to the
+        # border of the scene or unstable). Otherwise, they are decimated
+        self.lazy = lazy
+        self.lazy_margin = lazy_margin
+        self.lazy_refresh = lazy_refresh
+
         # Features
         self.velocity = Velocity(mmp=self.sample_bins, world_size=world_size)
         self.histogram = Histogram(grayscale)
         self.hog = Hog()
         self.position = None
         self.mosse = MosseFilter()
+        # Compact copy of the descriptors taken when leaving the scene
+        self.snapshot = None
 
         # State
         self.moved = False
@@ -76,8 +118,13 @@ class Tracker:
         self.stable = True
         self.out_roi = False
         self.is_dead = False
-        self.dead_time = 0
+        self.pool_time = None
         self.samples = 0
+        self.unstable_time = 0
+        self.stale = False
+        self.dormant = False
+        # Bumped on each appearance update (invalidates the snapshots)
+        self.version = 0
 
     def _validate_roi(self, ROI):
         if not ROI is None:
@@ -104,16 +151,19 @@ class Tracker:
 
         # Initialise some features
         cropped = crop_roi(frame, roi)
-        gray = cv.cvtColor(cropped, cv.COLOR_BGR2GRAY)
+        gray = to_gray(cropped)
         self.histogram.initialise(cropped)
         self.hog.initialise(gray, roi)
         self.velocity.initialise(roi)
         self.mosse_valid = self.mosse.initialise(gray, roi)
+        self.version += 1
 
         # Set the flag
         self.stable = stable
 
         # Initialise tracker
+        if frame.ndim == 2:
+            self.tracker = _create_kcf(frame)
         return self.tracker.init(frame, tracker_roi)
 
     def _update_speed(self):
@@ -122,7 +172,7 @@ class Tracker:
 
     def _update_histogram(self, cropped):
         if self.grayscale:
-            gray = cv.cvtColor(cropped, cv.COLOR_BGR2GRAY)
+            gray = to_gray(cropped)
             self.histogram.update(gray)
         else:
             self.histogram.update(cropped)
@@ -143,18 +193,133 @@ class Tracker:
         cropped = crop_roi(gray, centred_roi)
 
         if self.mosse_valid:
-            self.mosse.update(cropped, centred_roi)
+            return self.mosse.update(cropped, centred_roi)
         else:
             self.mosse_valid = self.mosse.initialise(cropped, centred_roi)
+            return self.mosse_valid
+
+    def _near_border(self, ROI):
+        """
+        Checks if the tracker is close to the border of the valid zone, where
+        it is likely to go out of scene and, therefore, to be matched
+        """
+        if ROI is None:
+            return True
 
-    def update(self, frame, ROI=None):
-        # Analyse if it went out of scene to kill it from the local source
-        ok, bbox = self.tracker.update(frame)
-        p1 = (int(bbox[0]), int(bbox[1]))
-        p2 = (int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3]))
+        margin = self.lazy_margin
+        return (
+            self.roi[0][0] - ROI[0] < margin
+            or self.roi[0][1] - ROI[1] < margin
+            or ROI[2] - self.roi[1][0] < margin
+            or ROI[3] - self.roi[1][1] < margin
+        )
+
+    def _needs_refresh(self, ROI):
+        """
+        Decides if the appearance features must be refreshed in this frame
+        """
+        if not self.lazy:
+            return True
+        # Newly deployed: the features are required by the matcher
+        if self.samples <= self.sample_bins:
+            return True
+        # Recently unstable
+        if self.unstable_time > 0 or not self.stable:
+            return True
+        if self._near_border(ROI):
+            return True
+        # Decimated refresh for the rest
+        return self.samples % self.lazy_refresh == 0
+
+    def _refresh_features(self, frame, gray_frame):
+        """
+        Updates the appearance features (histogram, hog and mosse). The
+        pooled trackers keep the descriptors of their snapshot
+        """
+        if not self.pool_time is None or self.is_dead:
+            return
+        gray = crop_roi(gray_frame, self.roi)
+        cropped = crop_roi(frame, self.roi)
+
+        self._update_histogram(cropped)
+        self._update_hog(gray)
+        if not self._update_mosse(gray_frame):
+            self.unstable_time = self.lazy_refresh
+        self.stale = False
+        self.version += 1
+        # The descriptors changed: the snapshot is not valid anymore
+        self.snapshot = None
+
+    def freeze(self):
+        """
+        Takes the descriptor snapshot used by the matcher once the tracker
+        goes to the out-of-scene or dead pools. It is taken once: the pooled
+        trackers do not refresh their descriptors
+        """
+        if self.snapshot is None:
+            self.snapshot = DescriptorSnapshot(self)
+        return self.snapshot
+
+    def hibernate(self):
+        """
+        Releases the OpenCV tracker and its buffers. A dormant tracker never
+        tracks again: it is only read through its snapshot until it expires.
+        When it is re-linked, the new tracker takes its label and it leaves
+        the pool. The MOSSE training buffers are released as well, since the
+        snapshot keeps the filter
+        """
+        self.tracker = None
+        self.mosse = MosseFilter()
+        self.mosse_valid = False
+        self.dormant = True
+
+    def inherit(self, other):
+        """
+        Takes the identity and the motion state of a tracker from another
+        scene (handoff). The appearance is kept, since it was just taken from
+        this scene. The warm-up is skipped if the other tracker completed it
+        """
+        self.label = other.label
+        self.samples = max(self.samples, other.samples)
+
+        # Move the velocity to the reference system of this scene
+        dx, dy = 0, 0
+        if not other.roi_offset is None and not self.roi_offset is None:
+            dx = other.roi_offset[0] - self.roi_offset[0]
+            dy = other.roi_offset[1] - self.roi_offset[1]
+        self.velocity = copy.deepcopy(other.velocity)
+        self.velocity.translate(dx, dy)
+        self.position = computeCenterRoi(self.roi)
 
+    def descriptors(self):
+        """
+        Returns the object to compare with: the snapshot if frozen
+        """
+        if self.snapshot is None:
+            return self
+        return self.snapshot
+
+    def memory_usage(self):
+        """
+        Bytes used by the descriptors of the tracker (the OpenCV tracker
+        internals are not accounted)
+        """
+        usage = {
+            "histogram": self.histogram.memory_usage(),
+            "hog": self.hog.memory_usage(),
+            "mosse": self.mosse.memory_usage(),
+            "velocity": self.velocity.memory_usage(),
+            "snapshot": 0,
+        }
+        if not self.snapshot is None:
+            usage["snapshot"] = self.snapshot.memory_usage()
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def update(self, frame, ROI=None):
         # Verify if the tracker was classified as out of scene. This avoids
-        # redundant copies and avoid refreshing the out of scene trackers
+        # redundant copies and avoid refreshing the out of scene trackers.
+        # It is checked before tracking to not pay for a discarded update
 
         if self.out_roi:
             return False
@@ -165,34 +330,57 @@ class Tracker:
         if self.timeout == 0:
             return False
 
+        # Dormant trackers only wait for their timeout
+        if self.dormant:
+            if self.is_dead:
+                self.timeout -= 1
+            return True
+
         # If it's dead increase the counter
         if self.is_dead:
             self.timeout -= 1
 
+        # Analyse if it went out of scene to kill it from the local source
+        ok, bbox = self.tracker.update(frame)
+        p1 = (int(bbox[0]), int(bbox[1]))
+        p2 = (int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3]))
+
         # Verify if the tracker has died
         if ok:
             self.roi = (p1, p2)
         else:
+            # Snapshot the appearance before it goes to the dead pool
+            if not self.is_dead and self.stale:
+                gray_frame = to_gray(frame)
+                self._refresh_features(frame, gray_frame)
+            # Dead trackers never track again: keep the snapshot and release
+            # the OpenCV tracker
             self.is_dead = True
+            self.freeze()
+            self.hibernate()
             return True
 
         # In case of an alive tracker
 
-        # Crop and grayscale
-        gray_frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-        gray = crop_roi(gray_frame, self.roi)
-        cropped = crop_roi(frame, self.roi)
+        # Grayscale
+        gray_frame = to_gray(frame)
 
         # Update features
         self._update_speed()
         self.samples += 1
+        if self.unstable_time > 0:
+            self.unstable_time -= 1
 
         self.out_roi = True
         if self._validate_roi(ROI):
-            self._update_histogram(cropped)
-            self._update_hog(gray)
-            self._update_mosse(gray_frame)
+            if self._needs_refresh(ROI):
+                self._refresh_features(frame, gray_frame)
+            else:
+                self.stale = True
             self.out_roi = False
+        elif self.stale:
+            # Snapshot the appearance before it goes to the out-of-scene pool
+            self._refresh_features(frame, gray_frame)
 
         return True
 
@@ -212,12 +400,29 @@ def updateTrackers(frame, trackers, ROI=None):
 
 
 def deployTrackers(
-    colour, bb_list, trackers, ROI=None, offset=None, grayscale=True, world_size=None
+    colour,
+    bb_list,
+    trackers,
+    ROI=None,
+    offset=None,
+    grayscale=True,
+    world_size=None,
+    lazy=False,
+    lazy_margin=32,
+    lazy_refresh=10,
+    scene=None,
 ):
     newly_deployed = list([])
     for i in bb_list:
         tracker = Tracker(
-            (0, 255, 0), offset=offset, grayscale=grayscale, world_size=world_size
+            (0, 255, 0),
+            offset=offset,
+            grayscale=grayscale,
+            world_size=world_size,
+            lazy=lazy,
+            lazy_margin=lazy_margin,
+            lazy_refresh=lazy_refresh,
+            scene=scene,
         )
         do_add = tracker.init(colour, i, scene_roi=ROI)
         if do_add:
@@ -0,0 +1,94 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- Hashed timing wheel: each slot holds the buckets of the frames that map
+  to it, so an advance only touches the trackers which actually expire
+- The wheel works with frame counts, which is the world clock
+"""
+
+
+class ExpiryWheel:
+    def __init__(self, slots=256):
+        self._n_slots = slots
+        self._slots = []
+        for i in range(slots):
+            self._slots.append({})
+        self._expiry = {}
+        self._now = 0
+
+    def schedule(self, tracker, frame):
+        """
+        Schedules the expiration of the tracker at the given frame. If it
+        was already scheduled, it is rescheduled
+        """
+        self.cancel(tracker)
+        if frame <= self._now:
+            frame = self._now + 1
+
+        slot = self._slots[frame % self._n_slots]
+        bucket = slot.get(frame, None)
+        if bucket is None:
+            bucket = {}
+            slot[frame] = bucket
+        bucket[tracker.uid] = tracker
+        self._expiry[tracker.uid] = frame
+
+    def cancel(self, tracker):
+        """
+        Removes the tracker from the wheel
+        Returns True if it was scheduled
+        """
+        frame = self._expiry.pop(tracker.uid, None)
+        if frame is None:
+            return False
+
+        slot = self._slots[frame % self._n_slots]
+        bucket = slot[frame]
+        del bucket[tracker.uid]
+        if len(bucket) == 0:
+            del slot[frame]
+        return True
+
+    def expiry(self, tracker):
+        return self._expiry.get(tracker.uid, None)
+
+    def advance(self, frame):
+        """
+        Moves the wheel up to the given frame
+        Returns the list of expired trackers
+        """
+        expired = []
+        while self._now < frame:
+            self._now += 1
+            slot = self._slots[self._now % self._n_slots]
+            bucket = slot.pop(self._now, None)
+            if bucket is None:
+                continue
+            for uid, tracker in bucket.items():
+                del self._expiry[uid]
+                expired.append(tracker)
+        return expired
+
+    def __len__(self):
+        return len(self._expiry)
@@ -0,0 +1,128 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- The pooled trackers are projected to the current frame by using their
+  last velocity and the time they have spent in the pool
+- The uncertainty of the projection grows with the time in the pool, so the
+  gate radius grows too (up to a maximum)
+- The projections are indexed in a uniform grid whose cell is the base
+  radius, so a query only visits the neighbouring cells
+"""
+
+import math
+
+
+def absolute_position(tracker):
+    """
+    Computes the position of the tracker in the world reference system
+    """
+    if tracker.roi_offset is None:
+        offset = (0, 0)
+    else:
+        offset = tracker.roi_offset
+    return (tracker.position[0] + offset[0], tracker.position[1] + offset[1])
+
+
+def estimated_speed(tracker):
+    """
+    Returns the speed (dx, dy) in pixels per frame. Zero if the velocity has
+    not collected enough samples yet
+    """
+    speed = tracker.velocity.speed
+    if speed is None:
+        return (0.0, 0.0)
+
+    dx, dy = speed
+    if dx.speed_counter < dx.mobile_mean_param:
+        return (0.0, 0.0)
+    return (dx.speed, dy.speed)
+
+
+class SpatialGate:
+    def __init__(self, radius=64, growth=1.0, max_radius=None):
+        if max_radius is None:
+            max_radius = 4 * radius
+
+        # Hyper-parameters
+        self.radius = radius
+        self.growth = growth
+        self.max_radius = max_radius
+        self.cell = radius
+
+        self._grid = {}
+        self._reach = 0
+
+    def predict(self, tracker, frame_cnt):
+        """
+        Predicts the position of a pooled tracker and the radius of its gate
+        Returns: ((x, y), radius)
+        """
+        elapsed = 0
+        if not tracker.pool_time is None and not frame_cnt is None:
+            elapsed = max(frame_cnt - tracker.pool_time, 0)
+
+        x, y = absolute_position(tracker)
+        dx, dy = estimated_speed(tracker)
+        radius = min(self.radius + self.growth * elapsed, self.max_radius)
+        return (x + dx * elapsed, y + dy * elapsed), radius
+
+    def _cell_of(self, position):
+        return (int(position[0] // self.cell), int(position[1] // self.cell))
+
+    def build(self, trackers, frame_cnt):
+        """
+        Indexes the predicted positions of the pooled trackers
+        """
+        self._grid = {}
+        self._reach = 0
+        for tracker in trackers:
+            position, radius = self.predict(tracker, frame_cnt)
+            key = self._cell_of(position)
+            entry = (tracker, position, radius)
+            bucket = self._grid.get(key, None)
+            if bucket is None:
+                self._grid[key] = [entry]
+            else:
+                bucket.append(entry)
+            self._reach = max(self._reach, radius)
+
+    def query(self, position):
+        """
+        Returns the pooled trackers whose gate contains the position
+        """
+        candidates = []
+        cx, cy = self._cell_of(position)
+        reach = int(math.ceil(self._reach / self.cell))
+
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                bucket = self._grid.get((i, j), None)
+                if bucket is None:
+                    continue
+                for tracker, predicted, radius in bucket:
+                    dx = predicted[0] - position[0]
+                    dy = predicted[1] - position[1]
+                    if dx * dx + dy * dy <= radius * radius:
+                        candidates.append(tracker)
+        return candidates
@@ -0,0 +1,184 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- The histogram and hog are normalised to 1 and square-rooted. Then, the
+  Bhattacharyya coefficient becomes an inner product
+- Both embeddings are scaled by the square root of their weights, so the
+  inner product is the weighted appearance score of the matcher. Only the
+  positive weights are indexed
+- The index is an IVF: the first vectors become the centroids of the lists
+  and the rest are assigned to the closest one. A search only visits the
+  closest lists and rescores exactly
+- The embeddings are computed when the trackers enter the pool, since the
+  pooled trackers do not refresh their appearance
+"""
+
+import numpy as np
+
+
+class AppearanceIndex:
+    def __init__(self, weights=None, top_k=8, lists=16, probes=3):
+        if weights is None:
+            weights = {}
+
+        # Only the positive weights contribute to the similarity
+        self.w_histogram = max(weights.get("histogram", 0.0), 0.0)
+        self.w_hog = max(weights.get("hog", 0.0), 0.0)
+
+        # Hyper-parameters
+        self.top_k = top_k
+        self.n_lists = lists
+        self.probes = probes
+
+        self._centroids = []
+        self._lists = []
+        self._entries = {}
+        self._unindexed = {}
+        self._dims = None
+
+    def is_valid(self):
+        return self.w_histogram > 0.0 or self.w_hog > 0.0
+
+    def _normalise(self, feature, weight):
+        X = np.asarray(feature, dtype=np.float32).flatten()
+        total = np.sum(X)
+        if total <= 0.0:
+            return np.zeros(X.shape, dtype=np.float32)
+        return np.sqrt(X / total) * np.sqrt(weight)
+
+    def embed(self, tracker):
+        """
+        Computes the appearance embedding of the tracker
+        Returns None if the features are not available
+        """
+        tracker = tracker.descriptors()
+        parts = []
+        if self.w_histogram > 0.0:
+            if tracker.histogram.histogram is None:
+                return None
+            histogram = tracker.histogram.histogram
+            parts.append(self._normalise(histogram, self.w_histogram))
+        if self.w_hog > 0.0:
+            if tracker.hog.hog is None:
+                return None
+            parts.append(self._normalise(tracker.hog.hog, self.w_hog))
+        return np.concatenate(parts)
+
+    def _closest_lists(self, vector, n):
+        centroids = np.array(self._centroids)
+        scores = centroids.dot(vector)
+        n = min(n, len(self._centroids))
+        return np.argsort(-scores)[0:n]
+
+    def add(self, tracker):
+        """
+        Inserts the tracker in the index (or refreshes it)
+        """
+        self.remove(tracker)
+        vector = self.embed(tracker)
+
+        if self._dims is None and not vector is None:
+            self._dims = vector.shape[0]
+
+        # Trackers without a comparable embedding are always candidates
+        if vector is None or vector.shape[0] != self._dims:
+            self._unindexed[tracker.uid] = tracker
+            return
+
+        if len(self._centroids) < self.n_lists:
+            self._centroids.append(vector)
+            self._lists.append({})
+            list_idx = len(self._centroids) - 1
+        else:
+            list_idx = int(self._closest_lists(vector, 1)[0])
+
+        self._lists[list_idx][tracker.uid] = (tracker, vector)
+        self._entries[tracker.uid] = list_idx
+
+    def remove(self, tracker):
+        """
+        Removes the tracker from the index
+        Returns True if it was indexed
+        """
+        if not self._unindexed.pop(tracker.uid, None) is None:
+            return True
+        list_idx = self._entries.pop(tracker.uid, None)
+        if list_idx is None:
+            return False
+        del self._lists[list_idx][tracker.uid]
+        return True
+
+    def rank(self, tracker, candidates, k=None):
+        """
+        Keeps the k candidates with the highest appearance similarity
+        """
+        if k is None:
+            k = self.top_k
+        if len(candidates) <= k:
+            return candidates
+
+        vector = self.embed(tracker)
+        if vector is None or vector.shape[0] != self._dims:
+            return candidates
+
+        ranked = []
+        scores = []
+        for candidate in candidates:
+            list_idx = self._entries.get(candidate.uid, None)
+            if list_idx is None:
+                # Not comparable: it is kept
+                ranked.append(candidate)
+                continue
+            scores.append((candidate, self._lists[list_idx][candidate.uid][1]))
+
+        if len(scores) > 0:
+            vectors = np.array([v for c, v in scores])
+            similarity = vectors.dot(vector)
+            n = min(k, len(scores))
+            best = np.argpartition(-similarity, n - 1)[0:n]
+            for i in best:
+                ranked.append(scores[i][0])
+        return ranked
+
+    def search(self, tracker, k=None):
+        """
+        Returns the k pooled trackers with the highest appearance similarity
+        (approximate: only the closest lists are visited)
+        """
+        if k is None:
+            k = self.top_k
+
+        candidates = list(self._unindexed.values())
+        vector = self.embed(tracker)
+        if vector is None or vector.shape[0] != self._dims:
+            for entries in self._lists:
+                candidates += [t for t, v in entries.values()]
+            return candidates
+
+        for list_idx in self._closest_lists(vector, self.probes):
+            candidates += [t for t, v in self._lists[list_idx].values()]
+        return self.rank(tracker, candidates, k)
+
+    def __len__(self):
+        return len(self._entries) + len(self._unindexed)
@@ -0,0 +1,254 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- The linker works offline on a trace (see Utils/json_tracer). Each label
+  is a tracklet: its first and last frames, positions and velocities (the
+  velocities are estimated from the positions at both ends)
+- Gap closing: the end of a tracklet can be linked to the start of a later
+  one (1 to max_gap frames after). The end is projected over the gap with
+  its velocity and the candidates are the starts within the radius,
+  found with a KD-tree
+- Cost of a link: squared distance normalised by the radius, plus the
+  colour histogram dissimilarity if traced, plus the gap fraction
+- The links are solved at once as a LAP on the augmented matrix
+  [[links, no-end], [no-start, links^T]], where not linking costs
+  max_cost. Only the candidate pairs are stored (sparse)
+- The linked tracklets take the label of the first tracklet of the chain
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
+
+
+class Tracklets:
+    def __init__(self, trace, window=5, status=None):
+        """
+        Summarises the labels of a trace
+
+        Params:
+        * trace: list of frames, each a list of tracer entries. They need
+          the label and abs_position
+        * window: frames used to estimate the velocities at both ends
+        * status: states to take (default: all)
+        """
+        tracks = {}
+        histograms = {}
+        for frame_idx, frame in enumerate(trace):
+            for entry in frame:
+                if entry["label"] < 0:
+                    continue
+                if not status is None and not entry["status"] in status:
+                    continue
+                if not "abs_position" in entry:
+                    raise ValueError("Error: The trace has no abs_position")
+                track = tracks.setdefault(entry["label"], {})
+                track[frame_idx] = entry["abs_position"]
+                if "col_histogram" in entry:
+                    ends = histograms.setdefault(entry["label"], [None, None])
+                    if ends[0] is None:
+                        ends[0] = entry["col_histogram"]
+                    ends[1] = entry["col_histogram"]
+
+        self.labels = np.array(sorted(tracks.keys()), dtype=np.int64)
+        n = len(self.labels)
+        self.start = np.zeros((n,), dtype=np.int64)
+        self.end = np.zeros((n,), dtype=np.int64)
+        self.start_position = np.zeros((n, 2), dtype=np.float64)
+        self.end_position = np.zeros((n, 2), dtype=np.float64)
+        self.start_velocity = np.zeros((n, 2), dtype=np.float64)
+        self.end_velocity = np.zeros((n, 2), dtype=np.float64)
+
+        for i, label in enumerate(self.labels):
+            track = tracks[label]
+            frames = sorted(track.keys())
+            self.start[i], self.end[i] = frames[0], frames[-1]
+            self.start_position[i] = track[frames[0]]
+            self.end_position[i] = track[frames[-1]]
+
+            head = frames[0 : window + 1]
+            tail = frames[-window - 1 :]
+            if len(frames) > 1:
+                self.start_velocity[i] = (
+                    np.subtract(track[head[-1]], track[head[0]]) / (head[-1] - head[0])
+                )
+                self.end_velocity[i] = (
+                    np.subtract(track[tail[-1]], track[tail[0]]) / (tail[-1] - tail[0])
+                )
+
+        # Colour histograms at both ends (normalised), if traced
+        self.start_histogram = None
+        self.end_histogram = None
+        if n > 0 and len(histograms) == n:
+            # The traced histograms keep the shape of cv.calcHist: (bins, 1)
+            # or (3, bins, 1). They are compared as flat vectors
+            starts = np.array([histograms[l][0] for l in self.labels], dtype=np.float64)
+            ends = np.array([histograms[l][1] for l in self.labels], dtype=np.float64)
+            starts = starts.reshape((n, -1))
+            ends = ends.reshape((n, -1))
+            self.start_histogram = _normalise(starts)
+            self.end_histogram = _normalise(ends)
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def _normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Linker:
+    def __init__(self, radius=50, max_gap=10, max_cost=1.0, appearance=0.5, gap=0.1):
+        """
+        Params:
+        * radius: maximum distance in pixels between the projected end and
+          the start of two linked tracklets
+        * max_gap: maximum frames between the end and the start
+        * max_cost: cost of leaving an end or a start unlinked. A link is
+          only taken if it is cheaper
+        * appearance: weight of the histogram dissimilarity
+        * gap: weight of the gap (fraction of max_gap)
+        """
+        self.radius = radius
+        self.max_gap = max_gap
+        self.max_cost = max_cost
+        self.appearance = appearance
+        self.gap = gap
+        self.stats = {"tracklets": 0, "candidates": 0, "links": 0}
+
+    def candidates(self, tracklets):
+        """
+        Finds the candidate links and their costs
+        Returns: (ends, starts, costs) arrays
+        """
+        n = len(tracklets)
+        if n == 0:
+            empty = np.zeros((0,), dtype=np.int64)
+            return empty, empty, np.zeros((0,), dtype=np.float64)
+
+        # The projection over the gap may move the end up to |v| * max_gap
+        speed = np.linalg.norm(tracklets.end_velocity, axis=1)
+        reach = self.radius + speed * self.max_gap
+        tree = cKDTree(tracklets.start_position)
+        found = tree.query_ball_point(tracklets.end_position, reach)
+
+        counts = np.array([len(f) for f in found], dtype=np.int64)
+        ends = np.repeat(np.arange(n, dtype=np.int64), counts)
+        if len(ends) == 0:
+            return ends, ends, np.zeros((0,), dtype=np.float64)
+        starts = np.concatenate([np.asarray(f, dtype=np.int64) for f in found])
+
+        # Temporal constraint
+        gaps = tracklets.start[starts] - tracklets.end[ends]
+        valid = (gaps >= 1) & (gaps <= self.max_gap)
+        ends, starts, gaps = ends[valid], starts[valid], gaps[valid]
+
+        # Distance to the projected end
+        projected = (
+            tracklets.end_position[ends] + tracklets.end_velocity[ends] * gaps[:, None]
+        )
+        distance = np.linalg.norm(projected - tracklets.start_position[starts], axis=1)
+        valid = distance <= self.radius
+        ends, starts, gaps, distance = (
+            ends[valid],
+            starts[valid],
+            gaps[valid],
+            distance[valid],
+        )
+
+        costs = (distance / self.radius) ** 2 + self.gap * gaps / self.max_gap
+        if not tracklets.end_histogram is None:
+            similarity = np.einsum(
+                "ij,ij->i",
+                tracklets.end_histogram[ends],
+                tracklets.start_histogram[starts],
+            )
+            costs += self.appearance * (1.0 - similarity)
+        return ends, starts, costs
+
+    def solve(self, tracklets):
+        """
+        Solves the gap closing
+        Returns: list((end index, start index)) of the links
+        """
+        n = len(tracklets)
+        self.stats["tracklets"] = n
+        ends, starts, costs = self.candidates(tracklets)
+        self.stats["candidates"] = len(costs)
+        if len(costs) == 0:
+            self.stats["links"] = 0
+            return []
+
+        # Augmented matrix. The costs are shifted by 1: zeros are not stored
+        alternative = np.full((n,), self.max_cost / 2.0 + 1.0)
+        diagonal = np.arange(n, dtype=np.int64)
+        rows = np.concatenate([ends, diagonal, n + diagonal, n + starts])
+        cols = np.concatenate([starts, n + diagonal, diagonal, n + ends])
+        values = np.concatenate([costs + 1.0, alternative, alternative, np.ones_like(costs)])
+        matrix = coo_matrix((values, (rows, cols)), shape=(2 * n, 2 * n)).tocsr()
+
+        rows, cols = min_weight_full_bipartite_matching(matrix)
+        links = [(int(r), int(c)) for r, c in zip(rows, cols) if r < n and c < n]
+        self.stats["links"] = len(links)
+        return links
+
+    def link(self, tracklets):
+        """
+        Returns: {label: final label} for every tracklet
+        """
+        following = dict(self.solve(tracklets))
+        previous = {start: end for end, start in following.items()}
+
+        relabel = {}
+        for i in range(len(tracklets)):
+            # Chains are walked from their first tracklet
+            if i in previous:
+                continue
+            root = int(tracklets.labels[i])
+            j = i
+            while True:
+                relabel[int(tracklets.labels[j])] = root
+                if not j in following:
+                    break
+                j = following[j]
+        return relabel
+
+
+def relabel(trace, labels):
+    """
+    Applies the final labels to a trace (in place). The spawn time is the
+    one of the first tracklet of the chain
+    Returns: the trace
+    """
+    spawn = {}
+    for frame_idx, frame in enumerate(trace):
+        for entry in frame:
+            label = labels.get(entry["label"], entry["label"])
+            entry["label"] = label
+            if "spawn_time" in entry:
+                entry["spawn_time"] = spawn.setdefault(label, entry["spawn_time"])
+    return trace
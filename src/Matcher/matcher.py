@@ -30,16 +30,37 @@ Development notes:
   within the trackers
 - The analysis is from new to all out-of-scene
 
-- The matcher will return the: not matched values in new and out and the
-  new deployed trackers which matched
+- The matcher works on the tracker registry: the new deployed trackers
+  which matched are moved to current and the matched out trackers expire
+- With a scene graph, the pool is sharded by the scene the trackers left,
+  and a new tracker is only compared with the shards of its neighbourhood
+- With several workers, the new trackers are scored in parallel and the
+  proposals are resolved greedily (highest score first)
 """
 
-import copy
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+import Matcher.registry as Registry
+from Matcher.expiry import ExpiryWheel
+from Matcher.gating import absolute_position
+
 
 class Matcher:
-    def __init__(self, weights=None, th=None, max_dead_time=None):
+    def __init__(
+        self,
+        weights=None,
+        th=None,
+        max_dead_time=None,
+        pool=None,
+        max_pool=None,
+        world_size=None,
+        gate=None,
+        index=None,
+        graph=None,
+        workers=1,
+    ):
         # Defaulting
         if weights is None:
             weights = {
@@ -53,6 +74,10 @@ class Matcher:
             th = 0.45
         if max_dead_time is None:
             max_dead_time = 100
+        if pool is None:
+            pool = Registry.OUT
+        if world_size is None:
+            world_size = [1200, 1400]
         # Features to analyse
         self.ce_position = weights.get("position", 0.0) != 0.0
         self.ce_velocity = weights.get("velocity", 0.0) != 0.0
@@ -73,6 +98,27 @@ class Matcher:
         self.threshold = th
         self.max_dead_time = max_dead_time
 
+        # Pool of trackers to match against and its expiration
+        self.pool = pool
+        self.max_pool = max_pool
+        self._wheel = ExpiryWheel()
+        self.stats = {"admitted": 0, "expired": 0, "evicted": 0, "compared": 0}
+
+        # Position normalisation (maximum distance) and spatial gating
+        self.normaliser = np.linalg.norm(world_size[0:2])
+        self.gate = gate
+
+        # Appearance index over the pooled descriptors
+        self.index = index
+
+        # Scene adjacency: scene -> {uid: tracker}
+        self.graph = graph
+        self._shards = {}
+
+        # Parallel scoring
+        self.workers = workers
+        self._executor = None
+
     def _compare_histogram(self, lhs, rhs):
         """
         Computes the histogram probability lhs respect to rhs
@@ -157,74 +203,98 @@ class Matcher:
         if not self.ce_position:
             return np.array([0.0])
 
-        if lhs.roi_offset is None:
-            lroi = (0, 0)
-        else:
-            lroi = lhs.roi_offset
-        if rhs.roi_offset is None:
-            rroi = (0, 0)
-        else:
-            rroi = rhs.roi_offset
-
-        lpos = [lhs.position[0] + lroi[0], lhs.position[1] + lroi[1]]
-        rpos = [rhs.position[0] + rroi[0], rhs.position[1] + rroi[1]]
-
-        X = np.array(lpos)
-        Y = np.array(rpos)
+        X = np.array(absolute_position(lhs))
+        Y = np.array(absolute_position(rhs))
         # Normalise respect to the maximum distance
-        normaliser = np.linalg.norm([1200, 1400])
-        X = X / normaliser
-        Y = Y / normaliser
+        X = X / self.normaliser
+        Y = Y / self.normaliser
         # Compute the distance
         distance = np.linalg.norm(X - Y)
 
         return np.array([distance])
 
-    def filter(self, lhs, rhs):
+    def admit(self, registry, tracker, frame_cnt):
         """
-        Cleans the lhs based on the replicates on rhs
+        Moves the tracker to the pool and schedules its expiration. If the
+        pool is bounded, the oldest trackers are evicted
         """
-        for elem in lhs:
-            if elem in rhs:
-                lhs.remove(elem)
-
-        return lhs
-
-    def pre_clean(self, cur_v, new_v, out_v, dead_v):
-        cur_v = self.filter(cur_v, out_v)
-        new_v = self.filter(new_v, out_v)
-        new_v = self.filter(new_v, cur_v)
-        cur_v = self.filter(cur_v, dead_v)
-        return cur_v, new_v, out_v, dead_v
-
-    def post_clean(self, cur_v, new_v, out_v, last_idx, frame_cnt):
-        for tracker in out_v:
-            try:
-                cur_v.remove(tracker)
-            except:
-                # The scene doesn't delete the out-of-scene immediately
-                continue
-
-        for out_ in out_v:
-            out_.dead_time += 1
-            if out_.dead_time == self.max_dead_time:
-                out_v.remove(out_)
-
-        new_to_continue = []
-
-        for cur_ in cur_v:
-            # Check if it is already timed-out
-            if cur_.timeout == 0:
-                cur_v.remove(cur_)
-
-        for new_ in new_v:
+        ttl = self.max_dead_time
+        # Dead trackers also expire when they time out in their scenes
+        if self.pool == Registry.DEAD:
+            ttl = min(ttl, tracker.timeout)
+
+        registry.move(tracker, self.pool)
+        tracker.pool_time = frame_cnt
+        tracker.freeze()
+        # Pooled trackers never track again: release them
+        tracker.hibernate()
+        self._wheel.schedule(tracker, frame_cnt + ttl)
+        if not self.index is None:
+            self.index.add(tracker)
+        self._shard(tracker)[tracker.uid] = tracker
+        self.stats["admitted"] += 1
+
+        if self.max_pool is None:
+            return
+        while registry.count(self.pool) > self.max_pool:
+            self.retire(registry, registry.oldest(self.pool))
+            self.stats["evicted"] += 1
+
+    def retire(self, registry, tracker):
+        """
+        Removes the tracker from the pool before its expiration
+        """
+        self._wheel.cancel(tracker)
+        if not self.index is None:
+            self.index.remove(tracker)
+        self._shard(tracker).pop(tracker.uid, None)
+        if registry.contains(tracker, self.pool):
+            registry.remove(tracker)
+
+    def expire(self, registry, frame_cnt):
+        """
+        Removes the trackers whose time in the pool is over. This only
+        visits the expired trackers
+        """
+        expired = self._wheel.advance(frame_cnt)
+        for tracker in expired:
+            if not self.index is None:
+                self.index.remove(tracker)
+            self._shard(tracker).pop(tracker.uid, None)
+            if registry.contains(tracker, self.pool):
+                registry.remove(tracker)
+        self.stats["expired"] += len(expired)
+        return expired
+
+    def _shard(self, tracker):
+        """
+        Returns the shard of the pool for the scene of the tracker
+        """
+        scene = getattr(tracker, "scene", None)
+        shard = self._shards.get(scene, None)
+        if shard is None:
+            shard = {}
+            self._shards[scene] = shard
+        return shard
+
+    def post_clean(self, registry, last_idx, frame_cnt):
+        """
+        Promotes the new trackers with enough samples to current, labeling
+        them if needed
+        Params:
+        - registry: tracker registry
+        Returns:
+        - last_idx: last label assigned
+        """
+        # The new trackers leave the state while iterating: copy them
+        for new_ in list(registry.get(Registry.NEW)):
             # Check if it is already timed-out
             if new_.timeout == 0:
+                registry.remove(new_)
                 continue
 
             # Skipping until having the right number of samples
             if new_.samples < new_.sample_bins:
-                new_to_continue.append(new_)
                 continue
 
             # Labeling
@@ -232,69 +302,188 @@ class Matcher:
                 last_idx += 1
                 new_.label = {"id": last_idx, "time": frame_cnt}
             # Adding to the current list
-            if not new_ in cur_v:
-                cur_v.append(new_)
+            registry.move(new_, Registry.CURRENT)
 
-        new_v = list([])
-        return last_idx, cur_v, new_to_continue, out_v
+        return last_idx
 
-    def match(self, cur_v, new_v, out_v):
+    def _compare_appearance(self, lhs, rhs):
+        """
+        Computes the weighted hog, histogram and mosse scores
+        Returns:
+        - array with the weighted hog, histogram and mosse scores
+        """
+        scores = np.zeros((3,), dtype=np.float32)
+        scores[0] = self.w_hog * self._compare_hog(lhs, rhs)[0]
+        scores[1] = self.w_histogram * self._compare_histogram(lhs, rhs)[0]
+        scores[2] = self.w_mosse * self._compare_mosse(lhs, rhs)[0]
+        return scores
+
+    def _candidates(self, registry, new_):
+        """
+        Gets the pooled trackers which can be matched with the new tracker.
+        If there is a gate, only the ones whose predicted position is close
+        enough are taken. If there is an index, only the top-k most similar
+        in appearance are kept. If there is a scene graph, only the ones
+        which left a scene in the neighbourhood of the new tracker are taken
+        """
+        graph = self.graph
+        scene = getattr(new_, "scene", None)
+        if graph is None or scene is None:
+            graph = None
+
+        if self.gate is None and self.index is None:
+            if graph is None:
+                # Indexed by the caller, which may accept while holding it
+                return list(registry.get(self.pool))
+            candidates = list(self._shards.get(None, {}).values())
+            for neighbour in graph.neighbourhood(scene):
+                candidates += list(self._shards.get(neighbour, {}).values())
+            return candidates
+
+        if self.gate is None:
+            found = self.index.search(new_)
+        else:
+            found = self.gate.query(absolute_position(new_))
+
+        candidates = []
+        for out_ in found:
+            # The gate is built once per match: skip the retired ones
+            if not registry.contains(out_, self.pool):
+                continue
+            if graph is None or graph.adjacent(scene, out_.scene):
+                candidates.append(out_)
+
+        if not self.gate is None and not self.index is None:
+            candidates = self.index.rank(new_, candidates)
+        return candidates
+
+    def score(self, new_, candidates):
+        """
+        Computes the matching probabilities of the new tracker against each
+        candidate
+        Params:
+        - new_: tracker or descriptor snapshot
+        - candidates: list of trackers or snapshots (compared through their
+          descriptors())
+        Returns:
+        - array with a probability per candidate
+        """
+        probabilities = np.zeros((len(candidates),), dtype=np.float32)
+
+        # Find the probabilities of all the trackers
+        for cnt, out_ in enumerate(candidates):
+            # Pooled trackers are compared through their snapshot
+            pooled = out_.descriptors()
+            weights = np.zeros((6,), dtype=np.float32)
+            # Compare position
+            weights[0] = self.w_position * self._compare_position(new_, pooled)[0]
+            # Compare speed and direction
+            velocity = self._compare_velocity(new_, pooled)
+            weights[1] = self.w_velocity * velocity[0]
+            weights[2] = self.w_angle * velocity[1]
+            # Compare hog, histo and mosse
+            weights[3:6] = self._compare_appearance(new_, pooled)
+            # Probability Superposition
+            probabilities[cnt] = weights.sum()
+        return probabilities
+
+    def _accept(self, registry, new_, out_tracker):
+        """
+        Links the new tracker with the pooled one, which leaves the pool
+        Returns: True if the new tracker took a label
+        """
+        accepted = False
+        out_tracker.timeout = 0
+        if not out_tracker.label is None:
+            # Accept
+            new_.label = out_tracker.label
+            registry.move(new_, Registry.CURRENT)
+            accepted = True
+        # Remove from the pool
+        self.retire(registry, out_tracker)
+        return accepted
+
+    def _match_parallel(self, registry, pending):
+        """
+        Scores the new trackers in parallel and resolves the proposals
+        greedily: the highest probabilities are accepted first and each
+        pooled tracker is only taken once
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        jobs = []
+        for new_ in pending:
+            candidates = self._candidates(registry, new_)
+            if len(candidates) > 0:
+                jobs.append((new_, candidates))
+        scores = self._executor.map(lambda job: self.score(*job), jobs)
+
+        proposals = []
+        for (new_, candidates), probabilities in zip(jobs, scores):
+            self.stats["compared"] += len(candidates)
+            max_idx = np.argmax(probabilities)
+            if probabilities[max_idx] >= self.threshold:
+                proposals.append((probabilities[max_idx], new_, candidates[max_idx]))
+        proposals.sort(key=lambda proposal: -proposal[0])
+
+        matches = 0
+        for probability, new_, out_tracker in proposals:
+            # Already taken by a better proposal
+            if not registry.contains(out_tracker, self.pool):
+                continue
+            if self._accept(registry, new_, out_tracker):
+                matches += 1
+        return matches
+
+    def match(self, registry, frame_cnt=None):
         """
         Matcher
         Params:
-        - the vectors
+        - registry: tracker registry. The new trackers are matched against
+          the pool of the matcher (out-of-scene or dead)
+        - frame_cnt: current frame. Used to predict the pooled positions
         Returns:
-        - new_v: not matched
-        - out_v: not matched
-        - cur_v: updated list
+        - number of matches. The matched new trackers are moved to current
+          and the matched pooled trackers are expired
         """
-        out_local = list(set(out_v))
-        new_local = copy.copy(new_v)
-        cur_local = copy.copy(cur_v)
+        matches = 0
 
-        for new_ in new_v:
-            n_old = len(out_local)
-            if n_old == 0:
+        if registry.count(self.pool) == 0:
+            return matches
+
+        if not self.gate is None:
+            self.gate.build(registry.get(self.pool), frame_cnt)
+
+        pending = [
+            new_
+            for new_ in registry.get(Registry.NEW)
+            if new_.samples >= new_.sample_bins
+        ]
+        if self.workers > 1 and len(pending) > 1:
+            return self._match_parallel(registry, pending)
+
+        for new_ in pending:
+            if registry.count(self.pool) == 0:
                 break
-            probabilities = np.zeros((n_old,), dtype=np.float32)
-            cnt = 0
 
-            if new_.samples < new_.sample_bins:
+            out_local = self._candidates(registry, new_)
+            n_old = len(out_local)
+            if n_old == 0:
                 continue
-
-            # Find the probabilities of all the trackers
-            for out_ in out_local:
-                weights = np.zeros((6,), dtype=np.float32)
-                # Compare position
-                weights[0] = self.w_position * self._compare_position(new_, out_)[0]
-                # Compare speed and direction
-                velocity = self._compare_velocity(new_, out_)
-                weights[1] = self.w_velocity * velocity[0]
-                weights[2] = self.w_angle * velocity[1]
-                # Compare hog
-                weights[3] = self.w_hog * self._compare_hog(new_, out_)[0]
-                # Compare histo
-                weights[4] = self.w_histogram * self._compare_histogram(new_, out_)[0]
-                # Compare mosse
-                weights[5] = self.w_mosse * self._compare_mosse(new_, out_)[0]
-                # Probability Superposition
-                probabilities[cnt] = weights.sum()
-                cnt += 1
+            probabilities = self.score(new_, out_local)
+            self.stats["compared"] += n_old
 
             # Find the maximum (argmax)
             max_idx = np.argmax(probabilities)
             max_val = probabilities[max_idx]
 
             if max_val >= self.threshold:
-                out_tracker = out_local[max_idx]
-                out_tracker.timeout = 0
-                if not out_tracker.label is None:
-                    # Accept
-                    new_tracker = new_
-                    new_tracker.label = out_tracker.label
-                    cur_local.append(new_tracker)
-                    # Remove from the lists
-                    new_local.remove(new_tracker)
-                out_local.remove(out_tracker)
-
-        return cur_local, new_local, out_local
+                if self._accept(registry, new_, out_local[max_idx]):
+                    matches += 1
+
+        return matches
+
+    def __del__(self):
+        if not self._executor is None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,110 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+"""
+Development notes:
+- Each tracker lives in exactly one state at a time. This avoids the
+  replicates across the queues and makes the cleaning unnecessary
+- The states follow the same code as the tracer statuses
+- The transitions are: new -> current -> out/dead -> expired (removed)
+- The pools keep the insertion order, so the oldest tracker is the first one
+"""
+
+CURRENT = 0
+NEW = 1
+OUT = 2
+DEAD = 3
+
+STATES = (CURRENT, NEW, OUT, DEAD)
+
+
+class Registry:
+    def __init__(self):
+        self._states = {}
+        self._pools = {}
+        for state in STATES:
+            self._pools[state] = {}
+
+    def state(self, tracker):
+        """
+        Returns the state of the tracker or None if it is not registered
+        """
+        return self._states.get(tracker.uid, None)
+
+    def contains(self, tracker, state=None):
+        """
+        Checks if the tracker is registered (in the given state, if defined)
+        """
+        current = self._states.get(tracker.uid, None)
+        if state is None:
+            return not current is None
+        return current == state
+
+    def move(self, tracker, state):
+        """
+        Registers the tracker or moves it to the given state
+        Returns the previous state (None if it was not registered)
+        """
+        uid = tracker.uid
+        previous = self._states.get(uid, None)
+        if previous == state:
+            return previous
+        if not previous is None:
+            del self._pools[previous][uid]
+        self._pools[state][uid] = tracker
+        self._states[uid] = state
+        return previous
+
+    def remove(self, tracker):
+        """
+        Expires the tracker, removing it from the registry
+        Returns the state it had (None if it was not registered)
+        """
+        uid = tracker.uid
+        previous = self._states.pop(uid, None)
+        if not previous is None:
+            del self._pools[previous][uid]
+        return previous
+
+    def get(self, state):
+        """
+        Returns a read-only view of the trackers in the given state. The
+        view follows the registry: copy it (list) to modify the registry
+        while iterating it
+        """
+        return self._pools[state].values()
+
+    def oldest(self, state):
+        """
+        Returns the tracker that entered the given state first (or None)
+        """
+        for tracker in self._pools[state].values():
+            return tracker
+        return None
+
+    def count(self, state=None):
+        if state is None:
+            return len(self._states)
+        return len(self._pools[state])
+
+    def __len__(self):
+        return len(self._states)
@@ -204,6 +204,19 @@ class World:
                       i.colour, 1) 
         return self.canvas
     
+    def arrays(self):
+        '''
+        Returns the arrays (x, y, size, colour) of the cells whose centre is
+        within the playground
+        '''
+        cells = [i for i in self.active_instances if i.x < self.playground_size[1] \
+          and i.y < self.playground_size[0] and i.x >= 0 and i.y >= 0]
+        x = np.array([i.x for i in cells], dtype=np.float64)
+        y = np.array([i.y for i in cells], dtype=np.float64)
+        size = np.array([i.size for i in cells], dtype=np.float64)
+        colour = np.array([i.colour for i in cells], dtype=np.float64).reshape((-1, 3))
+        return x, y, size, colour
+
     def update(self):
         '''
         Run the per-instance update
@@ -229,6 +242,287 @@ class World:
             return True
 
 
+# -----------------------------------------------------------------------------
+# ArrayWorld class
+# Same dynamics as World, but the cells are rows of arrays
+# -----------------------------------------------------------------------------
+class ArrayWorld:
+    '''
+    Vectorised world: the positions, speeds, sizes and colours of the cells
+    are arrays, and all the cells are updated at once with the random
+    draws of a seeded generator. Mitosis appends the copies of the parents
+    '''
+    def __init__(self, playground_size=(1200, 1400, 3), \
+      playground_bg=[0,0,0], frames=15*30, instances=25, roi_padding=10, \
+      mitosis=0.0006, seed=None, speed_limits=(1,3), size_limits=(10,20), \
+      lr=0.05, margin=100):
+        self.initial_seed = instances * 2 // 3 # 66%
+        self.canvas = None
+        self.missing_life = frames
+        self.playground_size = playground_size
+        self.playgound_colour = playground_bg
+        self.instances = instances
+        self.roi_padding = roi_padding
+        self.last_instance_idx = self.initial_seed
+        self.mitosis_rate = mitosis
+        self.total_instances = instances
+        self.mitosis_events = 0
+        self.rng = np.random.default_rng(seed)
+
+        # Limits (as the cells of World)
+        self.min_speed, self.max_speed = speed_limits
+        self.min_size, self.max_size = size_limits
+        self.lr = lr
+        self.min_x, self.max_x = margin, playground_size[1] - margin
+        self.min_y, self.max_y = margin, playground_size[0] - margin
+
+        # Create instances
+        n = self.initial_seed
+        rng = self.rng
+        self.x = rng.uniform(self.min_x, self.max_x, n)
+        self.y = rng.uniform(self.min_y, self.max_y, n)
+        self.dx = rng.uniform(-self.max_speed, self.max_speed, n)
+        self.dy = rng.uniform(-self.max_speed, self.max_speed, n)
+        self.size = rng.uniform(self.min_size, self.max_size, n)
+        palette = np.array(sns.color_palette("hls", instances)) * 255
+        self.colour = palette[0:n]
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    def visible(self):
+        '''
+        Mask of the cells whose centre is within the playground
+        '''
+        return (self.x >= 0) & (self.y >= 0) & \
+          (self.x < self.playground_size[1]) & (self.y < self.playground_size[0])
+
+    def arrays(self):
+        '''
+        Returns the arrays (x, y, size, colour) of the cells whose centre is
+        within the playground
+        '''
+        mask = self.visible()
+        return self.x[mask], self.y[mask], self.size[mask], self.colour[mask]
+
+    def getBBs(self):
+        '''
+        Get the current bounding boxes of the instances if they are valid
+        '''
+        mask = self.visible()
+        pad = self.size[mask] + self.roi_padding
+        x1 = (self.x[mask] - pad).astype(int)
+        x2 = (self.x[mask] + pad).astype(int)
+        y1 = (self.y[mask] - pad).astype(int)
+        y2 = (self.y[mask] + pad).astype(int)
+        return [((a, b), (c, d)) for a, b, c, d in zip(x1, y1, x2, y2)]
+
+    def draw(self, draw_bbs=False):
+        '''
+        Draws all the instances on the canvas. The canvas is reused
+        '''
+        if self.canvas is None:
+            self.canvas = np.empty(self.playground_size, dtype=np.uint8)
+        self.canvas[...] = self.playgound_colour
+        mask = self.visible()
+        xs = self.x[mask].astype(int)
+        ys = self.y[mask].astype(int)
+        sizes = self.size[mask].astype(int)
+        colours = self.colour[mask].tolist()
+        for x, y, r, colour in zip(xs.tolist(), ys.tolist(), sizes.tolist(), colours):
+            cv.circle(self.canvas, (x, y), r, colour, -1)
+        if draw_bbs:
+            for roi, colour in zip(self.getBBs(), colours):
+                cv.rectangle(self.canvas, roi[0], roi[1], colour, 1)
+        return self.canvas
+
+    def update(self):
+        '''
+        Run the update of all the instances
+        '''
+        n = len(self)
+        rng = self.rng
+        max_speed, max_size = self.max_speed, self.max_size
+
+        # Update position
+        self.x += self.dx
+        self.y += self.dy
+        # Update speed (only if it stays under the limit)
+        dx = self.lr * rng.uniform(-max_speed, max_speed, n)
+        dy = self.lr * rng.uniform(-max_speed, max_speed, n)
+        ok = np.abs(self.dx + dx) < max_speed
+        self.dx[ok] += dx[ok]
+        ok = np.abs(self.dy + dy) < max_speed
+        self.dy[ok] += dy[ok]
+        # Update size
+        size = self.lr * rng.uniform(-max_size, max_size, n) * 0.1
+        ok = (self.size + size < max_size) & (self.size + size >= self.min_size)
+        self.size[ok] += size[ok]
+
+        # Corner cases
+        bounce = (max_speed + self.min_speed) * 0.5
+        self.dx[self.x < -max_size] = bounce
+        self.dy[self.y < -max_size] = bounce
+        self.dx[self.x > max_size + self.max_x + self.min_x] = -bounce
+        self.dy[self.y > max_size + self.max_y + self.min_y] = -bounce
+
+        # Mitosis: the children copy their parents
+        parents = np.flatnonzero(rng.random(n) < self.mitosis_rate)
+        parents = parents[0:max(self.total_instances - self.last_instance_idx, 0)]
+        if parents.shape[0] > 0:
+            self.x = np.append(self.x, self.x[parents])
+            self.y = np.append(self.y, self.y[parents])
+            self.dx = np.append(self.dx, self.dx[parents])
+            self.dy = np.append(self.dy, self.dy[parents])
+            self.size = np.append(self.size, self.size[parents])
+            self.colour = np.append(self.colour, self.colour[parents], axis=0)
+            self.last_instance_idx += parents.shape[0]
+            self.mitosis_events += parents.shape[0]
+
+        self.missing_life -= 1
+        if self.missing_life == 0:
+            return False
+        else:
+            return True
+
+# -----------------------------------------------------------------------------
+# TileRenderer class
+# Draws the cells directly into the scene tiles
+# -----------------------------------------------------------------------------
+class TileRenderer:
+    '''
+    Renders each scene tile on its own buffer (reused across frames) instead
+    of drawing the whole world and cropping it. The cells are indexed in
+    buckets by their centre, so a tile only visits the cells of the buckets
+    it overlaps (extended by the largest cell). The tiles are clipped to the
+    playground as Tiling.crop_all does, so the edge tiles are smaller than
+    their ROI and a ROI out of the playground has no tile (None)
+    '''
+    def __init__(self, rois, playground_size=(1200, 1400, 3), \
+      playground_bg=[0,0,0], roi_padding=10, bucket=64):
+        '''
+        Params:
+        * rois: list([[x0, x1],[y0, y1]]) of the tiles
+        * playground_size: (h, w, c). With c == 1, the tiles are grayscale
+        * roi_padding: padding of the ground-truth boxes (as World.getBBs)
+        * bucket: side of the buckets in pixels
+        '''
+        self.rois = rois
+        self.playground_size = playground_size
+        self.roi_padding = roi_padding
+        self.bucket = bucket
+        self.channels = playground_size[2] if len(playground_size) > 2 else 1
+        self.background = playground_bg
+        if self.channels == 1:
+            self.background = self._gray(np.array([playground_bg]))[0]
+        self.nx = playground_size[1] // bucket + 1
+        self.ny = playground_size[0] // bucket + 1
+
+        # Clipped ROIs (as Tiling.placements), the origin of each tile
+        H, W = playground_size[0:2]
+        self.clipped = []
+        self.tiles = []
+        for (x0, x1), (y0, y1) in rois:
+            x0, x1 = max(x0, 0), min(x1, W)
+            y0, y1 = max(y0, 0), min(y1, H)
+            if x0 >= x1 or y0 >= y1:
+                self.clipped.append(None)
+                self.tiles.append(None)
+                continue
+            self.clipped.append(((x0, x1), (y0, y1)))
+            if self.channels == 1:
+                self.tiles.append(np.empty((y1 - y0, x1 - x0), dtype=np.uint8))
+            else:
+                self.tiles.append(np.empty((y1 - y0, x1 - x0, self.channels), \
+                  dtype=np.uint8))
+
+    def _gray(self, colour):
+        # Same weights as cv.COLOR_BGR2GRAY
+        return colour[:, 0] * 0.114 + colour[:, 1] * 0.587 + colour[:, 2] * 0.299
+
+    def _index(self, x, y):
+        '''
+        Sorts the cells by bucket
+        Returns: (order, sorted bucket keys)
+        '''
+        bx = np.clip((x // self.bucket).astype(np.int64), 0, self.nx - 1)
+        by = np.clip((y // self.bucket).astype(np.int64), 0, self.ny - 1)
+        keys = by * self.nx + bx
+        order = np.argsort(keys, kind="stable")
+        return order, keys[order]
+
+    def _query(self, order, keys, x0, x1, y0, y1, reach):
+        '''
+        Gets the cells whose centre is in the buckets overlapping the box
+        extended by reach (sorted, so the drawing order is kept)
+        '''
+        b = self.bucket
+        bx0 = max(int((x0 - reach) // b), 0)
+        bx1 = min(int((x1 + reach) // b), self.nx - 1)
+        by0 = max(int((y0 - reach) // b), 0)
+        by1 = min(int((y1 + reach) // b), self.ny - 1)
+        found = []
+        for by in range(by0, by1 + 1):
+            lo = np.searchsorted(keys, by * self.nx + bx0, side="left")
+            hi = np.searchsorted(keys, by * self.nx + bx1, side="right")
+            found.append(order[lo:hi])
+        if len(found) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        return np.sort(np.concatenate(found))
+
+    def render(self, world, ground_truth=False):
+        '''
+        Draws the cells of a World or ArrayWorld on the tiles
+
+        Params:
+        * world: playground to render
+        * ground_truth: also return the boxes of the cells per tile
+
+        Returns: list of tiles (the buffers are reused by the next call) and
+        the list of boxes ((x1,y1),(x2,y2)) per tile in tile coordinates if
+        ground_truth. A ROI out of the playground gets None and no boxes
+        '''
+        x, y, size, colour = world.arrays()
+        if self.channels == 1:
+            colour = self._gray(colour)[:, None]
+        order, keys = self._index(x, y)
+        reach = (size.max() if size.shape[0] > 0 else 0) + self.roi_padding
+
+        boxes = []
+        for tile, roi in zip(self.tiles, self.clipped):
+            if roi is None:
+                if ground_truth:
+                    boxes.append([])
+                continue
+            (x0, x1), (y0, y1) = roi
+            tile[...] = self.background
+            cells = self._query(order, keys, x0, x1, y0, y1, reach)
+            pad = size[cells] + self.roi_padding
+            cx, cy = x[cells], y[cells]
+            inside = (cx + pad >= x0) & (cx - pad < x1) & \
+              (cy + pad >= y0) & (cy - pad < y1)
+            cells = cells[inside]
+
+            xs = x[cells].astype(int) - x0
+            ys = y[cells].astype(int) - y0
+            radii = size[cells].astype(int)
+            for cxi, cyi, r, c in zip(xs.tolist(), ys.tolist(), radii.tolist(), \
+              colour[cells].tolist()):
+                cv.circle(tile, (cxi, cyi), r, c, -1)
+
+            if ground_truth:
+                pad = size[cells] + self.roi_padding
+                bx1 = (x[cells] - pad).astype(int) - x0
+                bx2 = (x[cells] + pad).astype(int) - x0
+                by1 = (y[cells] - pad).astype(int) - y0
+                by2 = (y[cells] + pad).astype(int) - y0
+                boxes.append([((a, b), (c, d)) for a, b, c, d in \
+                  zip(bx1.tolist(), by1.tolist(), bx2.tolist(), by2.tolist())])
+
+        if ground_truth:
+            return self.tiles, boxes
+        return self.tiles
+
 # -----------------------------------------------------------------------------
 # Testing resources
 # -----------------------------------------------------------------------------
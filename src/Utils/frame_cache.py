@@ -0,0 +1,128 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+"""
+Development notes:
+- The preprocessed stacks (decoded, converted and resized) are stored as
+  .npy files and memory-mapped when reused, so the frames are read from
+  the page cache on demand
+- The key is a hash of the sources (absolute path, size and mtime) and of
+  the preprocessing parameters. Changing a source or a parameter creates a
+  new entry. Old entries are not removed
+- The sources are the files the stack is decoded from. A directory only
+  changes when files are added, removed or renamed, so overwriting an
+  image in place would reuse the stale entry
+- The maps are copy-on-write: the trackers may modify the frames without
+  touching the cache
+- The stacks are written to a temporary file and renamed, so an interrupted
+  run never leaves a partial entry
+"""
+
+DEFAULT_ROOT = "../data/.frame_cache"
+
+
+def key(sources, params):
+    """
+    Computes the key of a stack
+    sources: list of files the stack comes from
+    params: dict with the preprocessing parameters (JSON serialisable)
+    """
+    description = []
+    for source in sources:
+        stat = os.stat(source)
+        description.append([os.path.abspath(source), stat.st_size, stat.st_mtime_ns])
+    text = json.dumps([description, params], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class FrameCache:
+    def __init__(self, root=DEFAULT_ROOT):
+        """
+        Params:
+        * root: directory of the cache entries
+        """
+        self.root = root
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _file(self, name):
+        return os.path.join(self.root, name + ".npy")
+
+    def load(self, sources, params, build):
+        """
+        Returns the stack of the sources, building it if it is not cached
+
+        Params:
+        * sources: list of files the stack comes from
+        * params: dict with the preprocessing parameters
+        * build: function which returns the stack (numpy array)
+
+        Returns: memory-mapped stack (uint8). If a source does not exist,
+        the stack is built and not cached
+        """
+        if not all([os.path.exists(source) for source in sources]):
+            self.stats["misses"] += 1
+            return build()
+
+        file = self._file(key(sources, params))
+        if os.path.exists(file):
+            self.stats["hits"] += 1
+            return np.load(file, mmap_mode="c")
+
+        self.stats["misses"] += 1
+        stack = np.ascontiguousarray(build(), dtype=np.uint8)
+        os.makedirs(self.root, exist_ok=True)
+        tmp = file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, stack)
+        os.replace(tmp, file)
+        return np.load(file, mmap_mode="c")
+
+
+class NullCache:
+    """
+    Cache which always builds the stacks
+    """
+
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0}
+
+    def load(self, sources, params, build):
+        self.stats["misses"] += 1
+        return build()
+
+
+def create(root):
+    """
+    Creates a cache in root. If root is None or False, a cache which
+    always builds the stacks
+    """
+    if root is None or root is False:
+        return NullCache()
+    if root is True:
+        return FrameCache()
+    return FrameCache(root)
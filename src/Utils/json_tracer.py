@@ -111,6 +111,12 @@ class Tracer:
 
         self.__data.append(frame)
 
+    def data(self):
+        """
+        Returns the recorded frames (see the format above)
+        """
+        return self.__data
+
     def dump(self):
         file_name = self.__prefix
         file_name += ".json"
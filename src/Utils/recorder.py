@@ -0,0 +1,138 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import queue
+import threading
+
+import cv2 as cv
+
+'''
+The recorder encodes the frames in a background thread, so the encoding
+latency is out of the tracking loop. The frames are copied (or downscaled)
+when submitted, since the drawing buffers are reused by the next frame.
+
+Policies when the encoder falls behind (the queue is full):
+  "drop": the submitted frame is discarded and counted as dropped
+  "block": the tracking waits until there is room in the queue
+'''
+
+DROP = "drop"
+BLOCK = "block"
+
+
+class Recorder:
+    def __init__(
+        self,
+        path,
+        size,
+        fps=25,
+        fourcc="MP4V",
+        queue_size=8,
+        policy=DROP,
+        decimation=1,
+        scale=1.0,
+    ):
+        """
+        Params:
+        * path: output video file
+        * size: (w, h) of the submitted frames
+        * fps: framerate of the output (already decimated)
+        * queue_size: frames waiting for the encoder
+        * policy: "drop" or "block"
+        * decimation: only one of each decimation frames is recorded
+        * scale: downscaling factor of the output
+        """
+        if not policy in (DROP, BLOCK):
+            raise ValueError("Error: Unknown recording policy " + str(policy))
+
+        w, h = size
+        self.size = (int(w * scale), int(h * scale))
+        self.scale = scale
+        self.policy = policy
+        self.decimation = max(int(decimation), 1)
+
+        self.stats = {"submitted": 0, "written": 0, "dropped": 0, "decimated": 0}
+
+        self._counter = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = cv.VideoWriter(
+            path, cv.VideoWriter_fourcc(*fourcc), fps, self.size, True
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            self._writer.write(frame)
+            self.stats["written"] += 1
+
+    def _prepare(self, frame):
+        if self.scale != 1.0:
+            return cv.resize(frame, self.size, interpolation=cv.INTER_AREA)
+        return frame.copy()
+
+    def write(self, frame):
+        """
+        Submits a frame to the encoder
+        Returns: True if the frame was queued
+        """
+        self._counter += 1
+        if (self._counter - 1) % self.decimation != 0:
+            self.stats["decimated"] += 1
+            return False
+
+        self.stats["submitted"] += 1
+        if self.policy == DROP and self._queue.full():
+            self.stats["dropped"] += 1
+            return False
+
+        frame = self._prepare(frame)
+        if self.policy == BLOCK:
+            self._queue.put(frame)
+            return True
+
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        return True
+
+    def depth(self):
+        """
+        Returns the number of frames waiting for the encoder
+        """
+        return self._queue.qsize()
+
+    def release(self):
+        """
+        Flushes the queued frames and closes the video
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._writer.release()
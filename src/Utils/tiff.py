@@ -20,15 +20,42 @@
 #
 # This project was sponsored by CNR-IOM
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import cv2 as cv
 import numpy as np
 
+"""
+Development notes:
+- The 12-bit to 8-bit conversion is a lookup table of 4096 entries which
+  includes the normalisation and the black offset (saturated to 255)
+- The table is computed with integers, so there is no float intermediate
+- OpenCV releases the GIL while reading and resizing, so the images are
+  loaded by a thread pool. The order of the paths is preserved
+"""
+
+LUT_SIZE = 4096
+
+
+@lru_cache(maxsize=16)
+def tiff12_lut(normalisation=2048, offset=0):
+    """
+    Lookup table from 12-bit values to 8-bit values
+    normalisation: max value within the image (mapped to 255)
+    offset: black offset added after the normalisation (saturated)
+    """
+    values = np.arange(LUT_SIZE, dtype=np.int64) * 255 // normalisation
+    values = np.minimum(values, 255) + offset
+    return np.clip(values, 0, 255).astype(np.uint8)
+
 
-def tiff12_open(img_path, normalisation=2048):
+def tiff12_open(img_path, normalisation=2048, offset=0):
     """
     Tiff 12 image opener
     img_path: path to the file
     normalisation: max value within the image
+    offset: black offset (saturated)
     """
     tiff = cv.imread(img_path, -1)
 
@@ -36,9 +63,27 @@ def tiff12_open(img_path, normalisation=2048):
         print("No image loaded...")
         return
 
-    # Compute the image
-    tiff = tiff.astype(np.float)
-    tiff *= 255.0
-    tiff /= normalisation
-    tiff = tiff.astype(np.uint8)
-    return tiff
+    # Values out of the 12 bits are saturated
+    np.minimum(tiff, LUT_SIZE - 1, out=tiff)
+    return tiff12_lut(normalisation, offset)[tiff]
+
+
+def tiff12_load(paths, normalisation=2048, offset=0, resize_to=None, workers=None):
+    """
+    Loads a sequence of Tiff 12 images in parallel
+    paths: list of files
+    normalisation: max value within the images
+    offset: black offset (saturated)
+    resize_to: (w, h) of the output images (optional)
+    workers: size of the thread pool (default: CPU count)
+    Returns: list of images in the same order as the paths
+    """
+
+    def _open(path):
+        tiff = tiff12_open(path, normalisation, offset)
+        if not tiff is None and not resize_to is None:
+            tiff = cv.resize(tiff, resize_to)
+        return tiff
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_open, paths))
@@ -0,0 +1,163 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import json
+import multiprocessing
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+'''
+The viewer runs in its own process and shows the latest frame published by
+the tracking loop. Both share a memory slot:
+
+[ header (8 x int64) | frame (h x w x c uint8) | stats (JSON, STATS_SIZE) ]
+
+where the header is:
+  0. Sequence: odd while the slot is being written
+  1. Stop flag
+  2. Length of the stats
+
+The tracking loop overwrites the slot and never waits for the viewer. The
+viewer only copies the slot when the sequence is even and did not change
+during the copy. Frames published faster than the viewer refreshes are
+simply skipped. Stats which do not fit in STATS_SIZE once encoded are
+dropped (the frame is still shown): a truncated JSON could not be parsed.
+'''
+
+HEADER_SIZE = 8
+STATS_SIZE = 4096
+
+
+def _views(shm, shape):
+    header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=shm.buf)
+    offset = header.nbytes
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+    offset += frame.nbytes
+    stats = np.ndarray((STATS_SIZE,), dtype=np.uint8, buffer=shm.buf, offset=offset)
+    return header, frame, stats
+
+
+def _show(name, shape, title, period):
+    """
+    Viewer process: displays the slot until the stop flag is set
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    header, frame, stats = _views(shm, shape)
+    last = 0
+
+    while header[1] == 0:
+        sequence = int(header[0])
+        if sequence % 2 == 0 and sequence != last:
+            image = frame.copy()
+            text = bytes(stats[0:header[2]])
+            # Discard the copy if the slot was written meanwhile
+            if header[0] == sequence:
+                last = sequence
+                y = 30
+                for key, value in json.loads(text.decode() or "{}").items():
+                    cv.putText(image, key + ": " + str(value), (10, y),
+                        cv.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+                    y += 20
+                cv.imshow(title, image)
+        cv.waitKey(period)
+
+    cv.destroyWindow(title)
+    del header, frame, stats
+    shm.close()
+
+
+class Viewer:
+    def __init__(self, shape, title="World", period=30):
+        """
+        Params:
+        * shape: (h, w, c) of the frames to publish
+        * title: window title
+        * period: refresh period of the viewer in milliseconds
+        """
+        self.shape = tuple(shape)
+        size = HEADER_SIZE * 8 + int(np.prod(self.shape)) + STATS_SIZE
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._header, self._frame, self._stats = _views(self._shm, self.shape)
+        self._header[:] = 0
+
+        self._process = multiprocessing.Process(
+            target=_show,
+            args=(self._shm.name, self.shape, title, period),
+            daemon=True,
+        )
+        self._process.start()
+
+    def publish(self, frame, stats=None):
+        """
+        Overwrites the slot with the frame and the stats (dict). It never
+        waits for the viewer. The stats are dropped if they do not fit in
+        STATS_SIZE
+        """
+        if frame.shape != self.shape:
+            raise ValueError("Error: The frame shape does not match the viewer")
+
+        text = b""
+        if not stats is None:
+            text = json.dumps(stats).encode()
+            if len(text) > STATS_SIZE:
+                text = b""
+
+        self._header[0] += 1
+        np.copyto(self._frame, frame)
+        self._stats[0:len(text)] = np.frombuffer(text, dtype=np.uint8)
+        self._header[2] = len(text)
+        self._header[0] += 1
+
+    def close(self):
+        if self._process is None:
+            return
+        self._header[1] = 1
+        self._process.join(timeout=1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        del self._header, self._frame, self._stats
+        self._shm.close()
+        self._shm.unlink()
+
+
+class NullViewer:
+    """
+    Viewer which discards everything (headless runs)
+    """
+
+    def publish(self, frame, stats=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def create(enabled, shape, title="World", period=30):
+    """
+    Creates a viewer process if enabled. Otherwise, a no-op viewer
+    """
+    if not enabled:
+        return NullViewer()
+    return Viewer(shape, title, period)
@@ -0,0 +1,87 @@
+# NanoSciTracker - 2020
+# Author: Luis G. Leon Vega <luis@luisleon.me>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+# This project was sponsored by CNR-IOM
+
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "LocalTracker"))
+
+import Matcher.linker as Linker
+from LocalTracker.features.histogram import Histogram
+
+
+def _histogram(seed, grayscale):
+    """
+    Traced col_histogram of a random patch (as Utils/json_tracer dumps it)
+    """
+    rng = np.random.default_rng(seed)
+    if grayscale:
+        patch = rng.integers(64, 256, (32, 32), dtype=np.uint8)
+    else:
+        patch = rng.integers(64, 256, (32, 32, 3), dtype=np.uint8)
+    feature = Histogram(grayscale=grayscale)
+    feature.initialise(patch)
+    return feature.histogram.tolist()
+
+
+def _trace(grayscale):
+    """
+    Two labels of the same cell split by a gap of 3 frames
+    """
+    trace = []
+    histogram = _histogram(0, grayscale)
+    for frame_idx in range(20):
+        frame = []
+        if frame_idx < 8 or frame_idx >= 11:
+            frame.append(
+                {
+                    "label": 1 if frame_idx < 8 else 2,
+                    "abs_position": [100.0 + 2 * frame_idx, 200.0],
+                    "status": 0,
+                    "spawn_time": 0 if frame_idx < 8 else 11,
+                    "col_histogram": histogram,
+                }
+            )
+        trace.append(frame)
+    return trace
+
+
+def test_link_with_traced_histograms():
+    for grayscale in (True, False):
+        tracklets = Linker.Tracklets(_trace(grayscale))
+        assert tracklets.start_histogram.shape[0] == 2
+        assert tracklets.start_histogram.ndim == 2
+
+        labels = Linker.Linker().link(tracklets)
+        assert labels == {1: 1, 2: 1}
+
+
+def test_status_filter():
+    trace = _trace(True)
+    # Frozen pool entry: it would move the end of the first tracklet
+    trace[9].append({"label": 1, "abs_position": [116.0, 200.0], "status": 2})
+    tracklets = Linker.Tracklets(trace, status=[0])
+    assert tracklets.end[0] == 7